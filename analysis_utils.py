@@ -6,11 +6,12 @@ author: Mert Unsal
 Contains the functions for analyzing electrophysiological data, specifically finding out if there's a modulation between spindle, slow waves and spike trains.
 """
 
+import weakref
 import numpy as np
+import pandas as pd
 from matplotlib import pyplot as plt
 from scipy import signal
-from scipy import fftpack
-import statistics as stat
+import instrument_utils
 
 '''
 This function takes peak indexes and total length of data as input and returns the spike train.
@@ -22,6 +23,131 @@ def get_spike_train(peak_index, length):
         spike_train[i] = 1
     return spike_train
 
+'''
+This class holds the spike trains of several units in a compact (CSR style) format, so that the memory scales with the number of spikes instead of the length of the recording.
+The sorted spike indexes of all units are stored one after another in the int64 array indices and indices[offsets[i]:offsets[i + 1]] are the spike indexes of unit i.
+length is the number of data points of the recording, i.e. the length the dense spike trains would have.
+Indexing with an integer returns a SpikeTrains of that unit only and indexing with a slice returns the selected units, so a SpikeTrains can be used in place of
+the list of dense spike trains in the functions which take the spike trains of all units.
+'''
+
+class SpikeTrains:
+    def __init__(self, indices, offsets, length):
+        self.indices = np.asarray(indices, dtype = np.int64)
+        self.offsets = np.asarray(offsets, dtype = np.int64)
+        self.length = int(length)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            units = range(len(self))[key]
+            if units.step == 1:
+                start = self.offsets[units.start] if len(units) > 0 else 0
+                offsets = self.offsets[units.start:units.stop + 1] - start if len(units) > 0 else np.zeros(1, dtype = np.int64)
+                return SpikeTrains(self.indices[start:start + offsets[-1]], offsets, self.length)
+            return get_spike_trains([self.unit(i) for i in units], self.length)
+        unit = range(len(self))[key]
+        spikes = self.unit(unit)
+        return SpikeTrains(spikes, [0, len(spikes)], self.length)
+
+    # returns the sorted spike indexes of the unit as a view, without copying
+    def unit(self, i):
+        return self.indices[self.offsets[i]:self.offsets[i + 1]]
+
+    # returns the number of spikes of each unit
+    def num_spikes(self):
+        return np.diff(self.offsets)
+
+    # equivalent of slicing a dense spike train with [start:end], the indexes of the returned spike trains are relative to start
+    def window(self, start, end):
+        start = min(max(int(start), 0), self.length)
+        end = min(max(int(end), start), self.length)
+        units = []
+        offsets = np.zeros(len(self) + 1, dtype = np.int64)
+        for i in range(len(self)):
+            spikes = self.unit(i)
+            units.append(spikes[np.searchsorted(spikes, start):np.searchsorted(spikes, end)] - start)
+            offsets[i + 1] = offsets[i] + len(units[i])
+        indices = np.concatenate(units) if len(units) > 0 else np.zeros(0, dtype = np.int64)
+        return SpikeTrains(indices, offsets, end - start)
+
+    # returns the list of dense spike trains, in the format of get_spike_train
+    def to_dense(self):
+        return [get_spike_train(self.unit(i), self.length) for i in range(len(self))]
+
+'''
+This function takes a list of peak indexes (one array or list for each unit) and total length of data as input and returns the spike trains of all units as a SpikeTrains.
+Repeated indexes are counted once, as in get_spike_train.
+'''
+
+def get_spike_trains(peak_indexes, length):
+    units = [np.asarray(peak_index, dtype = np.int64).ravel() for peak_index in peak_indexes]
+    indexes = np.concatenate(units) if len(units) > 0 else np.zeros(0, dtype = np.int64)
+    if len(indexes) > 0 and (indexes.min() < 0 or indexes.max() >= length):
+        raise ValueError("peak indexes should be inside the data (0 <= index < length)")
+    labels = np.repeat(np.arange(len(units)), [len(spikes) for spikes in units])
+    return get_labeled_spike_trains(indexes, labels, len(units), length)
+
+'''
+This function takes the peak indexes of the spikes of all units in a single array, the unit of every spike (0 <= label < num_units) and total length of data, and returns the spike trains
+of all units as a SpikeTrains, with a single sort of all spikes instead of a loop over the units. Spikes outside the data are dropped and repeated indexes are counted once.
+'''
+
+def get_labeled_spike_trains(indexes, labels, num_units, length):
+    indexes = np.asarray(indexes, dtype = np.int64).ravel()
+    labels = np.asarray(labels, dtype = np.int64).ravel()
+    inside = (indexes >= 0) & (indexes < length) & (labels >= 0) & (labels < num_units)
+    # sorting unit * stride + index sorts the spikes by unit, then by index
+    stride = max(int(length), 1)
+    keys = np.sort(labels[inside] * stride + indexes[inside])
+    keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])] if len(keys) > 0 else keys
+    units = keys // stride
+    offsets = np.zeros(num_units + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum(np.bincount(units, minlength = num_units))
+    instrument_utils.count("spikes", len(keys))
+    return SpikeTrains(keys - units * stride, offsets, length)
+
+'''
+This function takes the spike trains of all units either as a SpikeTrains, a list of dense spike trains or a single dense spike train and returns them as a SpikeTrains.
+'''
+
+def as_spike_trains(spike_train):
+    if isinstance(spike_train, SpikeTrains):
+        return spike_train
+    if isinstance(spike_train, np.ndarray) and spike_train.ndim == 1:
+        spike_train = [spike_train]
+    length = len(spike_train[0]) if len(spike_train) > 0 else 0
+    return get_spike_trains([np.flatnonzero(np.asarray(train) == 1) for train in spike_train], length)
+
+'''
+This function calls function(spike_train = spike_train, **kwargs) with the units split across the workers of backend ('thread' or 'process') and n_jobs, see map_units in parallel_utils.
+It is used by the functions of this module which take backend and n_jobs, when their backend isn't 'serial'.
+'''
+
+def split_units(function, spike_train, kwargs, backend, n_jobs):
+    from parallel_utils import map_units # imported here since parallel_utils imports this module
+    return map_units(function, spike_train, kwargs, backend, n_jobs)
+
+'''
+This function takes a single spike train (dense array or SpikeTrains) and returns the indexes of its spikes. Spikes of all units are put together if a SpikeTrains of several units is given.
+'''
+
+def get_spike_indexes(spike_train):
+    if isinstance(spike_train, SpikeTrains):
+        return np.sort(spike_train.indices)
+    return np.flatnonzero(np.asarray(spike_train) == 1)
+
+'''
+This function takes a single spike train (dense array or SpikeTrains) and the start and end indexes of a time interval and returns spike_train[start:end].
+'''
+
+def slice_spike_train(spike_train, start, end):
+    if isinstance(spike_train, SpikeTrains):
+        return spike_train.window(start, end)
+    return spike_train[start:end]
+
 '''
 This function takes frequency, number of data points, sampling frequency, and amplitude (optional, 1 if not specified) as input and returns the intended sine_wave
 '''
@@ -47,40 +173,528 @@ def generate_sinsinwave(freq_sin0, freq_sin1, len_data, fs, amplitude = 1):
     return sinsin_wave
 
 '''
-This function takes spike_train, its sampling rate, a sin wave frequency, and phase (in radians) interval as input. It returns an histogramic data for spike_train using phase intervals as bins.
-It is required data the sine_wave and the spike_train are of same size. It is assumed that 2 pi is divisible by the phase. The array generated in this function will be inserted in
-plotting functions to plot bar charts accordingly.
+This function takes the phase (in radians) interval of a histogram and returns the number of bins and the bins in degrees, as used in the output of phase_hist.
+It is assumed that 2 pi is divisible by the phase.
 '''
 
-def phase_hist(spike_train, freq_sin, phase, fs):
-    arr = [[],[]] # the second will contain bins and first will contain heights
-
+def get_phase_bins(phase):
     bin_range =  (2 * np.pi) / phase
 
     if float(int(bin_range)) != bin_range:
         raise ValueError("2 pi should be divisible by the phase")
 
-    for i in range( int(bin_range)):
-        arr[1].append(round(i * phase * (180 / np.pi)))
+    bins = [round(i * phase * (180 / np.pi)) for i in range(int(bin_range))]
+    return [int(bin_range), bins]
+
+'''
+This function takes spike indexes, a sin wave frequency, phase (in radians) interval and sampling rate as input and returns the number of spikes in each phase bin as an array.
+Phase of a spike is computed with respect to a sine wave that starts (phase 0) at index 0. Bins include their lower edge and exclude their upper edge,
+so a spike that lands exactly on the edge between two bins is counted in the upper one.
+'''
+
+def phase_hist_indexes(spike_index, freq_sin, phase, fs):
+    num_bins = get_phase_bins(phase)[0]
+    position = np.asarray(spike_index, dtype = np.int64) * (freq_sin * num_bins / fs)
+    # the small tolerance keeps spikes exactly on a bin edge from falling into the lower bin because of floating point errors
+    bin_index = np.floor(position + 1e-9).astype(np.int64) % num_bins
+    return np.bincount(bin_index, minlength = num_bins)
+
+'''
+This function takes the number of data points of a recording with sampling frequency fs and returns the number of data points of the same recording with sampling frequency sf.
+It can be used to find the length of the spike trains from the length of the LFP data when the spikes are recorded with a different sampling frequency, so that the LFP data doesn't have
+to be resampled to the sampling frequency of the spikes.
+'''
+
+def convert_length(length, fs, sf):
+    return int(sf * length * (1 / fs))
+
+'''
+This function takes indexes of data points with sampling frequency fs and returns the indexes of the same time points with sampling frequency sf (truncated as int() does).
+'''
+
+def convert_indexes(index, fs, sf):
+    return (np.asarray(index, dtype = np.float64) * (sf / fs)).astype(np.int64)
+
+'''
+This function takes an event dataFrame (output of find_spindles or find_slowwave) and a sampling frequency and returns the start and end indexes of every event
+in that sampling frequency as two int64 arrays. Indexes are truncated as int(time * fs) does. Since the times of the events are in seconds, the sampling frequency can be
+the one of the spike trains even if the events were found in data with a different sampling frequency.
+'''
+
+def get_event_indexes(events, fs):
+    start_index = (np.asarray(events.loc[:,"Start"], dtype = np.float64) * fs).astype(np.int64)
+    end_index = (np.asarray(events.loc[:,"End"], dtype = np.float64) * fs).astype(np.int64)
+    return [start_index, end_index]
+
+'''
+This function takes start and end indexes of events and the spike trains of all units (SpikeTrains) and finds the spikes of every unit inside every event
+with a single searchsorted call. It returns [lo, hi], two (units x events) arrays such that spike_train.indices[lo[i, j]:hi[i, j]] are the spikes of unit i in event j.
+Events are clipped to the recording.
+'''
+
+def get_event_spike_ranges(start_index, end_index, spike_train):
+    num_units = len(spike_train)
+    start_index = np.clip(np.asarray(start_index, dtype = np.int64), 0, spike_train.length)
+    end_index = np.clip(np.asarray(end_index, dtype = np.int64), start_index, spike_train.length)
+    # unit * stride + spike index is sorted over all units, since the spikes of each unit are sorted and units are stored one after another
+    stride = spike_train.length + 1
+    unit_offset = (np.arange(num_units, dtype = np.int64) * stride)[:, np.newaxis]
+    keys = np.repeat(np.arange(num_units, dtype = np.int64) * stride, spike_train.num_spikes()) + spike_train.indices
+    lo = np.searchsorted(keys, unit_offset + start_index[np.newaxis, :])
+    hi = np.searchsorted(keys, unit_offset + end_index[np.newaxis, :])
+    return [lo, hi]
+
+'''
+This function takes start and end indexes of events, durations of events (in seconds), the spike trains of all units (list of dense spike trains or SpikeTrains),
+sampling frequency and a time interval in seconds (dt) as input. It returns the firing rate of every unit in every event as a (units x events x 3) array, holding the rates in
+[start - dt:start], [event duration] and [end : end + dt] respectively. Windows (including the events themselves) that go beyond the recording are clipped and their rates are computed over
+the part inside the recording, a window which is completely outside of the recording has a rate of nan. Units can be split across workers with backend and n_jobs, as in events_phase_hist.
+'''
+
+def peri_event_rates(start_index, end_index, duration, spike_train, sf, dt, backend = 'serial', n_jobs = None):
+    if backend != 'serial':
+        kwargs = {'start_index': start_index, 'end_index': end_index, 'duration': duration, 'sf': sf, 'dt': dt}
+        return split_units(peri_event_rates, spike_train, kwargs, backend, n_jobs)
+
+    spike_train = as_spike_trains(spike_train)
+    start_index = np.asarray(start_index, dtype = np.int64)
+    end_index = np.asarray(end_index, dtype = np.int64)
+    num_events = len(start_index)
+    before_index = (start_index - dt * sf).astype(np.int64)
+    after_index = (end_index + dt * sf).astype(np.int64)
+
+    # before, during and after windows of all events are counted with a single searchsorted
+    lo, hi = get_event_spike_ranges(np.concatenate([before_index, start_index, end_index]), np.concatenate([start_index, end_index, after_index]), spike_train)
+    counts = (hi - lo).reshape(len(spike_train), 3, num_events)
+    instrument_utils.count("events", num_events)
+
+    # every window is clipped to the recording and its time (dt, or the duration of the event) is scaled by the part that is left
+    clip = lambda index: np.clip(index, 0, spike_train.length)
+    full_length = np.stack([start_index - before_index, end_index - start_index, after_index - end_index])
+    clipped_length = np.stack([clip(start_index) - clip(before_index), clip(end_index) - clip(start_index), clip(after_index) - clip(end_index)])
+    full_time = np.stack([np.full(num_events, dt, dtype = np.float64), np.asarray(duration, dtype = np.float64), np.full(num_events, dt, dtype = np.float64)])
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        window = np.where(clipped_length > 0, full_time * clipped_length / full_length, np.nan)
+
+    return counts.transpose(0, 2, 1) / window.T[np.newaxis, :, :]
+
+'''
+This function takes start and end indexes of events and the spike trains of all units (SpikeTrains) and returns [pair, spikes] for all spikes of all units inside all events:
+spikes are the spike indexes and pair is unit_index * number_of_events + event_index of each of them. Spikes inside several events appear once for every event.
+'''
+
+def get_event_spikes(start_index, end_index, spike_train):
+    num_pairs = len(spike_train) * len(start_index)
+    lo, hi = get_event_spike_ranges(start_index, end_index, spike_train)
+    lo = lo.ravel()
+    counts = hi.ravel() - lo
+
+    # positions of the spikes of every (unit, event) pair in spike_train.indices, one pair after another
+    pair_start = np.cumsum(counts) - counts
+    pair = np.repeat(np.arange(num_pairs, dtype = np.int64), counts)
+    position = np.arange(len(pair), dtype = np.int64) - pair_start[pair] + lo[pair]
+    return [pair, spike_train.indices[position]]
+
+'''
+This class is an interval index over events given by their start and end indexes (e.g. get_event_indexes), for queries on millions of spikes in O(n log m) instead of slicing the data
+once per event or building a boolean vector as long as the recording. Events are kept sorted by start with their ids (row numbers of the dataFrame unless event_ids is given),
+and overlapping events are merged into ranges for the inside/outside queries. An index i is inside an event if start <= i < end.
+'''
+
+class EventIndex:
+    def __init__(self, start_index, end_index, event_ids = None):
+        start_index = np.asarray(start_index, dtype = np.int64)
+        end_index = np.asarray(end_index, dtype = np.int64)
+        event_ids = np.arange(len(start_index)) if event_ids is None else np.asarray(event_ids)
+        order = np.argsort(start_index, kind = 'stable')
+        self.start_index = start_index[order]
+        self.end_index = end_index[order]
+        self.event_ids = event_ids[order]
+        # running maximum of the ends, and the event which has it, for events which contain an index although a later event has started
+        self.max_end = np.maximum.accumulate(self.end_index) if len(order) > 0 else self.end_index
+        self.max_event = np.maximum.accumulate(np.where(self.end_index == self.max_end, np.arange(len(order)), 0)) if len(order) > 0 else order
+        self.ranges = merge_ranges(self.start_index, self.end_index)
+
+    def __len__(self):
+        return len(self.start_index)
+
+    # returns the id of the event containing every index (the one which ends last if several events contain it), -1 for indexes outside of all events
+    def find(self, indexes):
+        indexes = np.asarray(indexes, dtype = np.int64)
+        if len(self) == 0:
+            return np.full(len(indexes), -1)
+        position = np.maximum(np.searchsorted(self.start_index, indexes, side = 'right') - 1, 0)
+        found = (indexes >= self.start_index[0]) & (indexes < self.max_end[position])
+        return np.where(found, self.event_ids[self.max_event[position]], -1)
+
+    # returns a boolean array which is True for the indexes inside any event
+    def contains(self, indexes):
+        indexes = np.asarray(indexes, dtype = np.int64)
+        if len(self) == 0:
+            return np.zeros(len(indexes), dtype = bool)
+        position = np.maximum(np.searchsorted(self.ranges[0], indexes, side = 'right') - 1, 0)
+        return (indexes >= self.ranges[0][0]) & (indexes < self.ranges[1][position])
+
+    # returns [inside, outside], the indexes inside any event and outside of all events
+    def split(self, indexes):
+        indexes = np.asarray(indexes)
+        inside = self.contains(indexes)
+        return [indexes[inside], indexes[~inside]]
+
+    # returns the ids of the events overlapping [first:last), in the order of their starts
+    def overlapping(self, first, last):
+        lo = np.searchsorted(self.max_end, first, side = 'right')
+        hi = np.searchsorted(self.start_index, last, side = 'left')
+        candidates = np.arange(lo, max(hi, lo))
+        return self.event_ids[candidates[self.end_index[candidates] > first]]
+
+    # returns the spikes of every unit of a SpikeTrains inside the events (outside of all events if inside is False) as a SpikeTrains
+    def filter_spike_trains(self, spike_train, inside = True):
+        spike_train = as_spike_trains(spike_train)
+        keep = self.contains(spike_train.indices) == inside
+        unit = np.repeat(np.arange(len(spike_train)), spike_train.num_spikes())
+        offsets = np.zeros(len(spike_train) + 1, dtype = np.int64)
+        np.cumsum(np.bincount(unit[keep], minlength = len(spike_train)), out = offsets[1:])
+        return SpikeTrains(spike_train.indices[keep], offsets, spike_train.length)
+
+'''
+This function takes an event dataFrame (output of find_spindles or find_slowwave) and a sampling frequency and returns the EventIndex of the events in that sampling frequency.
+'''
+
+def get_event_index(events, fs):
+    start_index, end_index = get_event_indexes(events, fs)
+    return EventIndex(start_index, end_index, np.asarray(events.index))
+
+'''
+This function takes start and end indexes of ranges sorted by start and returns [start, end] of the ranges after merging the overlapping and touching ones, which is a compact (run-length)
+form of a boolean vector which is True inside the ranges.
+'''
+
+def merge_ranges(start_index, end_index):
+    start_index = np.asarray(start_index, dtype = np.int64)
+    end_index = np.asarray(end_index, dtype = np.int64)
+    if len(start_index) == 0:
+        return [start_index, end_index]
+    max_end = np.maximum.accumulate(end_index)
+    # a new range begins at every start after the end of all the ranges before it
+    new = np.concatenate([[True], start_index[1:] > max_end[:-1]])
+    first = np.flatnonzero(new)
+    last = np.concatenate([first[1:], [len(start_index)]]) - 1
+    return [start_index[first], max_end[last]]
+
+'''
+This function takes start and end indexes of ranges and returns the indexes inside all of them, one range after another, without building an array as long as the data.
+'''
+
+def get_range_indexes(start_index, end_index):
+    start_index = np.asarray(start_index, dtype = np.int64)
+    counts = np.maximum(np.asarray(end_index, dtype = np.int64) - start_index, 0)
+    range_start = np.cumsum(counts) - counts
+    range_id = np.repeat(np.arange(len(counts)), counts)
+    return np.arange(len(range_id), dtype = np.int64) - range_start[range_id] + start_index[range_id]
+
+'''
+This function takes start and end indexes of events, sine wave frequency of every event, the spike trains of all units (list of dense spike trains or SpikeTrains),
+phase (in radians) interval and sampling frequency as input. It returns the phase histograms of every unit in every event as a (units x events x bins) count array,
+computed in a single pass. Phase 0 of every event is at its start index and bins are the same with phase_hist.
+Units can be split across several workers by choosing the 'thread' or 'process' backend (see parallel_utils.map_units), with n_jobs workers (number of cores if None).
+'''
+
+def events_phase_hist(start_index, end_index, freq, spike_train, phase, fs, backend = 'serial', n_jobs = None):
+    if backend != 'serial':
+        kwargs = {'start_index': start_index, 'end_index': end_index, 'freq': freq, 'phase': phase, 'fs': fs}
+        return split_units(events_phase_hist, spike_train, kwargs, backend, n_jobs)
+
+    spike_train = as_spike_trains(spike_train)
+    num_bins = get_phase_bins(phase)[0]
+    start_index = np.asarray(start_index, dtype = np.int64)
+    freq = np.asarray(freq, dtype = np.float64)
+    num_units = len(spike_train)
+    num_events = len(start_index)
+
+    pair, spikes = get_event_spikes(start_index, end_index, spike_train)
+    instrument_utils.count("events", len(start_index))
+    instrument_utils.count("spikes_binned", len(pair))
+    event = pair % max(num_events, 1)
+    relative_index = spikes - start_index[event]
+    bin_position = relative_index * (freq[event] * num_bins / fs)
+    bin_index = np.floor(bin_position + 1e-9).astype(np.int64) % num_bins
+
+    hist = np.bincount(pair * num_bins + bin_index, minlength = num_units * num_events * num_bins)
+    return hist.reshape(num_units, num_events, num_bins)
+
+'''
+This function takes start and end times of events (in seconds, e.g. the "Start" and "End" columns of find_spindles) and a sampling frequency, and returns the indexes of the first spike index
+inside every event and the first one after it, so that spike index i is inside an event if start_time <= i / sf < end_time. Unlike get_event_indexes, the times are not truncated.
+'''
+
+def get_warped_event_indexes(start_time, end_time, sf):
+    start_index = np.ceil(np.asarray(start_time, dtype = np.float64) * sf).astype(np.int64)
+    end_index = np.ceil(np.asarray(end_time, dtype = np.float64) * sf).astype(np.int64)
+    return [start_index, end_index]
+
+'''
+This function takes start and end times of events (in seconds), the spike trains of all units (list of dense spike trains or SpikeTrains), their sampling frequency and a number of bins,
+and returns the time-warped histograms of every unit in every event as a (units x events x bins) count array: every event is stretched to [0, 1) and the spike at time t is put into the bin
+of its position (t - start) / (end - start), computed with float precision. It is the histogram of one cycle of the event, as in the spindle envelope (frequency 1 / duration), for all units
+and events in a single pass. Units can be split across workers with backend and n_jobs, as in events_phase_hist.
+'''
+
+def time_warped_hist(start_time, end_time, spike_train, sf, num_bins, backend = 'serial', n_jobs = None):
+    if backend != 'serial':
+        kwargs = {'start_time': start_time, 'end_time': end_time, 'sf': sf, 'num_bins': num_bins}
+        return split_units(time_warped_hist, spike_train, kwargs, backend, n_jobs)
+
+    spike_train = as_spike_trains(spike_train)
+    start_time = np.asarray(start_time, dtype = np.float64)
+    end_time = np.asarray(end_time, dtype = np.float64)
+    num_units = len(spike_train)
+    num_events = len(start_time)
+
+    start_index, end_index = get_warped_event_indexes(start_time, end_time, sf)
+    pair, spikes = get_event_spikes(start_index, end_index, spike_train)
+    instrument_utils.count("events", len(start_index))
+    instrument_utils.count("spikes_binned", len(pair))
+    event = pair % max(num_events, 1)
+    position = (spikes / sf - start_time[event]) / (end_time[event] - start_time[event])
+    bin_index = np.clip(np.floor(position * num_bins).astype(np.int64), 0, num_bins - 1)
+
+    hist = np.bincount(pair * num_bins + bin_index, minlength = num_units * num_events * num_bins)
+    return hist.reshape(num_units, num_events, num_bins)
+
+'''
+This function takes an event dataFrame (output of find_spindles or find_slowwave), a sampling frequency and the column of the event times to align to ("Start", "Peak", "End",
+"NegPeak", ...) and returns the index of that time of every event in that sampling frequency as an int64 array, truncated as in get_event_indexes.
+'''
+
+def get_event_align_indexes(events, fs, align = "Start"):
+    return (np.asarray(events.loc[:,align], dtype = np.float64) * fs).astype(np.int64)
+
+'''
+This function takes a time window relative to the events [before, after] (in seconds, e.g. [-1, 2]), a bin size (in seconds) and a sampling frequency and returns
+[first, last, num_bins, bin_length]: the window in data points relative to the event ([first:last]), the number of bins and the length of a bin in data points.
+'''
+
+def get_peri_event_window(window, bin_size, sf):
+    num_bins = max(int(round((window[1] - window[0]) / bin_size)), 1)
+    first = int(round(window[0] * sf))
+    bin_length = bin_size * sf
+    last = first + int(round(num_bins * bin_length))
+    return [first, last, num_bins, bin_length]
+
+'''
+This function takes the indexes of the events to align to (e.g. get_event_align_indexes), the spike trains of all units (list of dense spike trains or SpikeTrains), sampling frequency
+and a time window [before, after] in seconds, and returns the raster of every unit around every event as [offsets, times]: times are the spike times relative to the event (in seconds)
+and times[offsets[unit * number_of_events + event]:offsets[unit * number_of_events + event + 1]] are the spikes of the unit around the event.
+The spikes of all units and events are found with a single searchsorted (see get_event_spikes), parts of the window outside of the recording have no spikes.
+'''
+
+def peri_event_raster(align_index, spike_train, sf, window):
+    spike_train = as_spike_trains(spike_train)
+    align_index = np.asarray(align_index, dtype = np.int64)
+    first = int(round(window[0] * sf))
+    last = int(round(window[1] * sf))
+    pair, spikes = get_event_spikes(align_index + first, align_index + last, spike_train)
+    instrument_utils.count("events", len(align_index))
+    instrument_utils.count("spikes", len(pair))
+    num_pairs = len(spike_train) * len(align_index)
+    offsets = np.zeros(num_pairs + 1, dtype = np.int64)
+    np.cumsum(np.bincount(pair, minlength = num_pairs), out = offsets[1:])
+    times = (spikes - align_index[pair % max(len(align_index), 1)]) / sf
+    return [offsets, times]
+
+'''
+This function takes the indexes of the events to align to, the spike trains of all units (list of dense spike trains or SpikeTrains), sampling frequency, a time window [before, after] and
+a bin size in seconds, and returns the peri-event time histograms of every unit around every event as [counts, bins]: counts is a (units x events x bins) count array and
+bins are the edges of the bins in seconds relative to the event. Bins are closed on their lower edge. Units can be split across workers with backend and n_jobs, as in events_phase_hist.
+'''
+
+def peri_event_histogram(align_index, spike_train, sf, window = [-1, 1], bin_size = 0.01, backend = 'serial', n_jobs = None):
+    first, last, num_bins, bin_length = get_peri_event_window(window, bin_size, sf)
+    bins = (first + np.arange(num_bins + 1) * bin_length) / sf
+    if backend != 'serial':
+        kwargs = {'align_index': align_index, 'sf': sf, 'window': window, 'bin_size': bin_size}
+        return [split_units(peri_event_counts, spike_train, kwargs, backend, n_jobs), bins]
+    return [peri_event_counts(align_index, spike_train, sf, window, bin_size), bins]
+
+'''
+This function computes the (units x events x bins) counts of peri_event_histogram.
+'''
+
+def peri_event_counts(align_index, spike_train, sf, window, bin_size):
+    spike_train = as_spike_trains(spike_train)
+    align_index = np.asarray(align_index, dtype = np.int64)
+    first, last, num_bins, bin_length = get_peri_event_window(window, bin_size, sf)
+    num_units = len(spike_train)
+    num_events = len(align_index)
+
+    pair, spikes = get_event_spikes(align_index + first, align_index + last, spike_train)
+    instrument_utils.count("events", len(align_index))
+    instrument_utils.count("spikes_binned", len(pair))
+    relative_index = spikes - align_index[pair % max(num_events, 1)] - first
+    bin_index = np.minimum(np.floor(relative_index / bin_length + 1e-9).astype(np.int64), num_bins - 1)
+    counts = np.bincount(pair * num_bins + bin_index, minlength = num_units * num_events * num_bins)
+    return counts.reshape(num_units, num_events, num_bins)
+
+'''
+This function takes the output of peri_event_histogram and a unit index and plots the average firing rate of the unit around the events.
+'''
+
+def plot_peri_event_histogram(peth, unit):
+    counts, bins = peth
+    bin_size = bins[1] - bins[0]
+    plt.title("Peri-Event Time Histogram (Unit {0})".format(unit))
+    plt.xlabel("Time (s)")
+    plt.ylabel("Firing Rate (Hz)")
+    plt.bar(bins[:-1], counts[unit].mean(axis = 0) / bin_size, width = bin_size, align = 'edge')
+    plt.axvline(0, color = 'r')
+    plt.show()
+
+'''
+This function takes the output of peri_event_raster, the number of events and a unit index and plots the spikes of the unit around every event, one row per event.
+'''
+
+def plot_raster(raster, num_events, unit):
+    offsets, times = raster
+    first = unit * num_events
+    events = np.repeat(np.arange(num_events), np.diff(offsets[first:first + num_events + 1]))
+    plt.title("Raster (Unit {0})".format(unit))
+    plt.xlabel("Time (s)")
+    plt.ylabel("Event")
+    plt.scatter(times[offsets[first]:offsets[first + num_events]], events, marker = '|', color = 'k')
+    plt.axvline(0, color = 'r')
+    plt.show()
+
+# names of the outputs of spindle_all_units / sw_all_units and spindle_envelope_all_units, in the order of their old list format
+ALL_UNITS_OUTPUTS = ["num_spikes", "phase_hist_spike_trains", "time_spike_trains", "unit_hist_arrays"]
+ENVELOPE_OUTPUTS = ["phase_hist_spike_trains", "unit_hist_arrays"]
+
+'''
+This class holds the phase histograms of all units in all events in arrays, instead of dictionaries of lists:
+counts is a (units x events x bins) array of spike counts, bins are the bins of the histograms in degrees and phase is the phase interval of the bins (in radians).
+unit_ids and event_ids are the indexes of the units and events along the first two axes of counts. start_index and end_index are the indexes of the events in the spike trains.
+spike_lo and spike_hi are (units x events) arrays such that spike_train.indices[spike_lo[i, j]:spike_hi[i, j]] are the spikes of unit i in event j, so the spike trains in the events
+are not copied. num_spikes and unit_hist give the total number of spikes of each unit and the sum of the histograms over all events (units x bins).
+The results can be saved to a .npz file with save and loaded again with load_event_phase_hist (the spike train of the loaded results only holds the spikes inside the events),
+and select_events gives the results of a subset of the events.
+Indexing with an integer (or unpacking) gives the outputs in their old list format, e.g. [num_spikes, phase_hist_spike_trains, time_spike_trains, unit_hist_arrays] for
+spindle_all_units, and the dictionaries are only built when they are asked for.
+'''
+
+class EventPhaseHist:
+    def __init__(self, counts, bins, phase, start_index, end_index, spike_lo, spike_hi, spike_train, outputs = ALL_UNITS_OUTPUTS, unit_ids = None, event_ids = None):
+        self.counts = np.asarray(counts)
+        self.bins = list(bins)
+        self.phase = phase
+        self.start_index = np.asarray(start_index, dtype = np.int64)
+        self.end_index = np.asarray(end_index, dtype = np.int64)
+        self.spike_lo = np.asarray(spike_lo, dtype = np.int64)
+        self.spike_hi = np.asarray(spike_hi, dtype = np.int64)
+        self.spike_train = spike_train
+        self.outputs = list(outputs)
+        self.unit_ids = np.arange(self.counts.shape[0]) if unit_ids is None else np.asarray(unit_ids)
+        self.event_ids = np.arange(self.counts.shape[1]) if event_ids is None else np.asarray(event_ids)
+
+    def __len__(self):
+        return len(self.outputs)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [getattr(self, name) for name in self.outputs[index]]
+        return getattr(self, self.outputs[index])
+
+    def __iter__(self):
+        return iter(self[:])
+
+    @property
+    def num_spikes(self):
+        return self.counts.sum(axis = (1, 2))
+
+    @property
+    def unit_hist(self):
+        return self.counts.sum(axis = 1)
+
+    # returns the spike train of the unit in the event, with spike indexes relative to the start of the event
+    def event_spikes(self, unit, event):
+        spikes = self.spike_train.indices[self.spike_lo[unit, event]:self.spike_hi[unit, event]] - self.start_index[event]
+        return SpikeTrains(spikes, [0, len(spikes)], max(self.end_index[event] - self.start_index[event], 0))
+
+    # returns the results of the selected events only (an index array or boolean mask over the events), keeping their event ids
+    def select_events(self, events):
+        events = np.arange(self.counts.shape[1])[events]
+        return EventPhaseHist(self.counts[:, events], self.bins, self.phase, self.start_index[events], self.end_index[events], self.spike_lo[:, events], self.spike_hi[:, events],
+                              self.spike_train, self.outputs, self.unit_ids, self.event_ids[events])
+
+    @property
+    def phase_hist_spike_trains(self):
+        return {str(unit): {str(event): [self.counts[i, j].tolist(), self.bins] for j, event in enumerate(self.event_ids)} for i, unit in enumerate(self.unit_ids)}
+
+    @property
+    def time_spike_trains(self):
+        return {str(unit): {str(event): self.event_spikes(i, j) for j, event in enumerate(self.event_ids)} for i, unit in enumerate(self.unit_ids)}
+
+    @property
+    def unit_hist_arrays(self):
+        unit_hist = self.unit_hist
+        return {str(unit): [unit_hist[i], self.bins] for i, unit in enumerate(self.unit_ids)}
+
+    # saves the results to a .npz file; only the spikes inside the events are saved (with spike_lo and spike_hi rebased to them), so the file scales with the events, not the session
+    def save(self, path):
+        lo, hi = self.spike_lo.ravel(), self.spike_hi.ravel()
+        order = np.argsort(lo[hi > lo], kind = 'stable')
+        positions = get_range_indexes(*merge_ranges(lo[hi > lo][order], hi[hi > lo][order]))
+        np.savez_compressed(path, counts = self.counts, bins = np.asarray(self.bins), phase = self.phase, start_index = self.start_index, end_index = self.end_index,
+                            spike_lo = np.searchsorted(positions, self.spike_lo), spike_hi = np.searchsorted(positions, self.spike_hi), unit_ids = self.unit_ids,
+                            event_ids = self.event_ids, outputs = np.asarray(self.outputs), indices = self.spike_train.indices[positions],
+                            offsets = np.searchsorted(positions, self.spike_train.offsets), length = self.spike_train.length)
 
-    for i in range(int(bin_range)):
-        arr[0].append(0)
+'''
+This function takes the path of a file saved with EventPhaseHist.save and returns the EventPhaseHist.
+'''
+
+def load_event_phase_hist(path):
+    with np.load(path) as data:
+        spike_train = SpikeTrains(data["indices"], data["offsets"], int(data["length"]))
+        return EventPhaseHist(data["counts"], data["bins"].tolist(), float(data["phase"]), data["start_index"], data["end_index"], data["spike_lo"], data["spike_hi"],
+                              spike_train, data["outputs"].tolist(), data["unit_ids"], data["event_ids"])
+
+'''
+This function takes start and end indexes of events, sine wave frequency of every event, phase (in radians) interval, sampling frequency and the spike train of all units
+(list of dense spike trains or SpikeTrains) as input and computes the phase histograms of all units in all events with events_phase_hist. It returns them as an EventPhaseHist,
+which gives the outputs of spindle_all_units and sw_all_units ([num_spikes, phase_hist_spike_trains, time_spike_trains, unit_hist_arrays]) when indexed, or the ones in outputs.
+backend and n_jobs are passed to events_phase_hist.
+'''
+
+def events_all_units(start_index, end_index, freq, phase, fs, spike_train, outputs = ALL_UNITS_OUTPUTS, backend = 'serial', n_jobs = None):
+    spike_train = as_spike_trains(spike_train)
+    counts = events_phase_hist(start_index, end_index, freq, spike_train, phase, fs, backend, n_jobs)
+    spike_lo, spike_hi = get_event_spike_ranges(start_index, end_index, spike_train)
+    bins = get_phase_bins(phase)[1]
+    return EventPhaseHist(counts, bins, phase, start_index, end_index, spike_lo, spike_hi, spike_train, outputs)
+
+'''
+This function is the time-warped version of events_all_units: it takes start and end times of events (in seconds), phase (in radians) interval, sampling frequency and the spike trains of all units,
+and returns the time_warped_hist of all units in all events (with 2 pi / phase bins) as an EventPhaseHist. By default it gives the outputs of spindle_envelope_all_units.
+'''
 
-    data_phase = int( (fs * phase) / (2 * np.pi * freq_sin) )
-    ind = 0
-    for data in spike_train:
-        if data == 1:
-            flag = 0
-            normalized_phase = ind * 360 * freq_sin * (1/fs)
-            normalized_phase -= int(normalized_phase/360) * 360
-            for bin in arr[1]:
-                if (normalized_phase > bin) and (normalized_phase < (bin + round(phase * (180 / np.pi)) ) ):
-                    arr[0][flag] += 1
-                    break
-                flag += 1
-        ind += 1
+def events_warped_all_units(start_time, end_time, phase, sf, spike_train, outputs = ENVELOPE_OUTPUTS, backend = 'serial', n_jobs = None):
+    spike_train = as_spike_trains(spike_train)
+    num_bins, bins = get_phase_bins(phase)
+    counts = time_warped_hist(start_time, end_time, spike_train, sf, num_bins, backend, n_jobs)
+    start_index, end_index = get_warped_event_indexes(start_time, end_time, sf)
+    spike_lo, spike_hi = get_event_spike_ranges(start_index, end_index, spike_train)
+    return EventPhaseHist(counts, bins, phase, start_index, end_index, spike_lo, spike_hi, spike_train, outputs)
 
-    return arr
+'''
+This function takes spike_train (dense array or SpikeTrains), its sampling rate, a sin wave frequency, and phase (in radians) interval as input. It returns an histogramic data for spike_train using phase intervals as bins.
+It is required data the sine_wave and the spike_train are of same size. It is assumed that 2 pi is divisible by the phase. The array generated in this function will be inserted in
+plotting functions to plot bar charts accordingly.
+'''
+
+def phase_hist(spike_train, freq_sin, phase, fs):
+    bins = get_phase_bins(phase)[1]
+    heights = phase_hist_indexes(get_spike_indexes(spike_train), freq_sin, phase, fs)
+    return [heights.tolist(), bins] # the second contains bins and first contains heights
 
 '''
 This function takes the array generated by the phase_hist function and the phase of the bins to generate a polar bar chart of the spike train.
@@ -129,12 +743,79 @@ def get_spectrum(y, fs):
     frq = k/T
     frq = frq[range(int(n/2))]
 
-    Y = fftpack.fft(y)/n
+    # the input is real, so only the positive half of the spectrum is computed
+    Y = np.fft.rfft(y)/n
     Y = Y[range(int(n/2))]
     Y = abs(Y)
 
     return [Y, frq]
 
+'''
+This function takes a data source (1-D array-like such as a channel of a Recording, an array of shape (channels x samples) or a Recording, see recording_utils), a start and end index
+and the channels to read (all if None), and returns the samples in [start:end] as a float64 array of shape (channels x samples), or (samples) for 1-D data.
+'''
+
+def read_samples(data, start, end, channels = None):
+    if hasattr(data, 'channel'):
+        channels = range(data.num_channels) if channels is None else channels
+        return np.asarray(data.read(start, end, list(channels)), dtype = np.float64).T
+    data_slice = data[start:end] if np.ndim(data) == 1 else (data[:, start:end] if channels is None else data[list(channels), start:end])
+    return np.asarray(data_slice, dtype = np.float64)
+
+'''
+This function estimates the power spectral density of data (see read_samples for the types of data) by averaging the periodograms of segments of segment_duration seconds
+which start every step data points, each multiplied by every taper in tapers (an array of shape (tapers x segment length)). Segments are read chunk_duration seconds at a time,
+so a memory-mapped recording of any length is processed with bounded memory, and only the positive frequencies are computed (rfft) since the data is real.
+The output is [psd, freqs], the one-sided density in units^2/Hz (as scipy.signal.welch with scaling 'density') of shape (channels x freqs) for 2-D data and (freqs) for 1-D data.
+'''
+
+def streaming_spectrum(data, fs, tapers, step, channels = None, chunk_duration = 600):
+    tapers = np.atleast_2d(np.asarray(tapers, dtype = np.float64))
+    segment_length = tapers.shape[1]
+    length = len(data) if hasattr(data, 'channel') or np.ndim(data) == 1 else np.shape(data)[1]
+    if length < segment_length:
+        raise ValueError("data should be longer than a segment")
+    num_segments = (length - segment_length) // step + 1
+    batch_size = max(1, int(chunk_duration * fs) // step)
+
+    power = 0
+    for first in range(0, num_segments, batch_size):
+        last = min(first + batch_size, num_segments)
+        chunk = read_samples(data, first * step, (last - 1) * step + segment_length, channels)
+        segments = np.lib.stride_tricks.sliding_window_view(chunk, segment_length, axis = -1)[..., ::step, :]
+        segments = segments - segments.mean(axis = -1, keepdims = True)
+        for taper in tapers:
+            power = power + (np.abs(np.fft.rfft(segments * taper, axis = -1)) ** 2).sum(axis = -2)
+
+    freqs = np.fft.rfftfreq(segment_length, 1 / fs)
+    psd = power / (num_segments * fs * np.sum(tapers ** 2))
+    # power of the negative frequencies is added to the positive ones, except for the DC and Nyquist frequencies
+    psd[..., 1:segment_length - segment_length // 2] *= 2
+    return [psd, freqs]
+
+'''
+This function estimates the power spectral density of data (see read_samples) with Welch's method: Hann-windowed segments of segment_duration seconds, overlapping by overlap
+(a fraction of the segment), are averaged, so the spectrum is much less noisy than get_spectrum and get_major_freqs picks fewer noise peaks. The output is [psd, freqs], see streaming_spectrum.
+'''
+
+def welch_spectrum(data, fs, segment_duration = 4, overlap = 0.5, channels = None, chunk_duration = 600):
+    segment_length = int(segment_duration * fs)
+    step = max(int(segment_length * (1 - overlap)), 1)
+    window = signal.get_window('hann', segment_length)
+    return streaming_spectrum(data, fs, window, step, channels, chunk_duration)
+
+'''
+This function estimates the power spectral density of data (see read_samples) with the multitaper method: every non-overlapping segment of segment_duration seconds is multiplied by
+num_tapers Slepian (DPSS) tapers with time half-bandwidth product time_bandwidth (2 * time_bandwidth - 1 tapers if None), which smooths the spectrum over a band of
+2 * time_bandwidth / segment_duration Hz with less bias than a single window. The output is [psd, freqs], see streaming_spectrum.
+'''
+
+def multitaper_spectrum(data, fs, segment_duration = 4, time_bandwidth = 3, num_tapers = None, channels = None, chunk_duration = 600):
+    segment_length = int(segment_duration * fs)
+    num_tapers = int(2 * time_bandwidth - 1) if num_tapers is None else num_tapers
+    tapers = signal.windows.dpss(segment_length, time_bandwidth, num_tapers)
+    return streaming_spectrum(data, fs, tapers, segment_length, channels, chunk_duration)
+
 '''
 This function takes the output of find_spectrum function to plot frequency domain using Fourier Transform. Intended frequency range can be entered as an input
 to see that range closely in the graph but it is not required.
@@ -157,10 +838,11 @@ def plot_spectrum(Y, frq , freq_range = [0,0]):
 '''
 This function takes a signal array and the coefficient for determining minimum heights of the peaks. The coefficient is multiplied by the base noise in order to find the
 minimum peak height. The function returns aN array which includes peak heights and indexes in scipy format.
+The base noise is the standard deviation of the first 10% of the signal; for long recordings, detect_spikes (see spike_utils) streams over the data and estimates the noise in every chunk.
 '''
 
 def find_peaks(signal_array, coeff, spike = True):
-    height = np.sqrt(stat.variance(signal_array[:int(len(signal_array) / 10)]  )) * coeff
+    height = np.std(np.asarray(signal_array[:int(len(signal_array) / 10)], dtype = np.float64), ddof = 1) * coeff
     # signal is multiplied by -1 (we only want to find negative peaks in recording because positive peaks are followed after them)
     if spike:
         peaks = signal.find_peaks(np.multiply(signal_array, -1), height)
@@ -170,15 +852,16 @@ def find_peaks(signal_array, coeff, spike = True):
         return peaks
 
 '''
-This function takes the time range, time, and spike_train as input to plot the spike train in a specific time range.
+This function takes spike_train (dense array or a SpikeTrains of one unit), its sampling frequency sf and the time range as input to plot the spike train in a specific time range;
+start_time is the time (in seconds) of the first data point of the spike train. Spikes are drawn as ticks from their indexes (see plot_spike_ticks) instead of a line through every data point.
 '''
 
-def plot_spike_train(spike_train, time, time_limit):
+def plot_spike_train(spike_train, sf, time_limit, start_time = 0):
     plt.title("Spike Train")
     plt.xlabel("Time (s)")
     plt.ylabel("Spike Activity")
     plt.xlim(time_limit)
-    plt.plot(time, spike_train, color='b')
+    plot_spike_ticks(get_spike_indexes(spike_train), sf, time_limit, start_time, color='b')
     plt.show()
 
 
@@ -189,6 +872,130 @@ This function takes a wave as input and returns the envelope wave using Hilbert
 def get_envelope_wave(wave):
     return np.abs(signal.hilbert(wave))
 
+'''
+This function takes a data, its sampling frequency and a frequency range [low, high] (in Hz) and returns the data band-pass filtered in that range with a zero-phase Butterworth filter.
+'''
+
+def bandpass_filter(data, fs, freq_range, order = 4):
+    sos = signal.butter(order, freq_range, btype = 'bandpass', fs = fs, output = 'sos')
+    return signal.sosfiltfilt(sos, np.asarray(data, dtype = np.float64))
+
+'''
+This function takes a wave and its sampling frequency and returns its analytic signal using Hilbert Transform, as get_envelope_wave does. If chunk_duration (in seconds) is given,
+the transform is computed in overlapping chunks so that a long recording doesn't need one huge FFT; the halves of the overlaps near the chunk edges, where the transform is distorted,
+are dropped. The overlap should be several cycles of the slowest frequency in the wave.
+'''
+
+def get_analytic_signal(wave, fs, chunk_duration = None, overlap_duration = 10):
+    if chunk_duration is None:
+        return signal.hilbert(np.asarray(wave, dtype = np.float64))
+
+    length = len(wave)
+    overlap = int(overlap_duration * fs)
+    analytic = np.empty(length, dtype = np.complex128)
+    for start, end, owned_start, owned_end in get_chunks(length, fs, chunk_duration, overlap_duration):
+        chunk = signal.hilbert(np.asarray(wave[start:end], dtype = np.float64))
+        keep_start = start if start == 0 else start + overlap // 2
+        keep_end = end if end == length else end - (overlap - overlap // 2)
+        analytic[keep_start:keep_end] = chunk[keep_start - start:keep_end - start]
+    return analytic
+
+'''
+This function takes an analytic signal and returns its instantaneous phase in [0, 2 pi), using the convention of phase_hist: phase 0 is where the wave crosses zero going up, as sin(x) does at x = 0.
+'''
+
+def get_instantaneous_phase(analytic):
+    return np.mod(np.angle(analytic) + np.pi / 2, 2 * np.pi)
+
+'''
+This class computes and keeps the instantaneous phases of the channels of a recording (with sampling frequency fs), so that every unit and every event uses the same filtered signal
+instead of computing it again. For a channel and a frequency range, get returns [phase, envelope_phase]: phase is the instantaneous phase of the data band-pass filtered in the frequency range
+and envelope_phase is the instantaneous phase of the envelope of that filtered data (a full cycle of the envelope is a rise and fall of the oscillation, e.g. a spindle).
+Both are computed in a single pass (bandpass_filter, then get_analytic_signal in chunks) the first time they are asked for and stored as float32 to save memory.
+If a disk_cache (a DiskCache, see cache_utils) is given, the phases are also kept on the disk, keyed by source (e.g. file_fingerprint of the data file; the content of the data is hashed if None),
+channel, frequency range and sampling frequency, so they are not computed again in the next runs.
+'''
+
+class PhaseCache:
+    def __init__(self, fs, chunk_duration = 600, overlap_duration = 10, disk_cache = None, source = None):
+        self.fs = fs
+        self.chunk_duration = chunk_duration
+        self.overlap_duration = overlap_duration
+        self.disk_cache = disk_cache
+        self.source = source
+        self.phases = {}
+
+    def get(self, channel, data, freq_range):
+        key = (channel, tuple(freq_range))
+        if key not in self.phases:
+            if self.disk_cache is None:
+                self.phases[key] = self.compute(data, freq_range)
+            else:
+                source = np.asarray(data) if self.source is None else self.source
+                compute = lambda: dict(zip(["phase", "envelope_phase"], self.compute(data, freq_range)))
+                phases = self.disk_cache.cached(compute, "phase", source, channel, list(freq_range), self.fs, self.chunk_duration, self.overlap_duration)
+                self.phases[key] = [phases["phase"], phases["envelope_phase"]]
+        return self.phases[key]
+
+    # computes [phase, envelope_phase] of the data band-pass filtered in freq_range
+    def compute(self, data, freq_range):
+        filtered = bandpass_filter(data, self.fs, freq_range)
+        analytic = get_analytic_signal(filtered, self.fs, self.chunk_duration, self.overlap_duration)
+        del filtered
+        envelope = np.abs(analytic)
+        phase = get_instantaneous_phase(analytic).astype(np.float32)
+        del analytic
+        envelope_analytic = get_analytic_signal(envelope - envelope.mean(), self.fs, self.chunk_duration, self.overlap_duration)
+        envelope_phase = get_instantaneous_phase(envelope_analytic).astype(np.float32)
+        return [phase, envelope_phase]
+
+    # deletes the phases of a channel (of all channels if channel is None) to free memory
+    def clear(self, channel = None):
+        for key in list(self.phases):
+            if channel is None or key[0] == channel:
+                del self.phases[key]
+
+'''
+This function takes an instantaneous phase signal with sampling frequency fs and spike indexes with sampling frequency sf and returns the phase at every spike,
+by indexing the phase signal at the data point of each spike.
+'''
+
+def get_spike_phases(phase_signal, spike_index, fs, sf):
+    index = np.clip(convert_indexes(spike_index, sf, fs), 0, len(phase_signal) - 1)
+    return np.asarray(phase_signal[index], dtype = np.float64)
+
+'''
+This function takes start and end indexes of events in the spike trains, an instantaneous phase signal (e.g. from PhaseCache) with sampling frequency fs, the spike trains of all units
+(list of dense spike trains or SpikeTrains) with sampling frequency sf and phase (in radians) interval. It returns the histograms of the phases of the spikes of every unit in every event
+as a (units x events x bins) count array, with the same bins as phase_hist.
+'''
+
+def events_signal_phase_hist(start_index, end_index, phase_signal, spike_train, phase, fs, sf):
+    spike_train = as_spike_trains(spike_train)
+    num_bins = get_phase_bins(phase)[0]
+    num_pairs = len(spike_train) * len(start_index)
+
+    pair, spikes = get_event_spikes(start_index, end_index, spike_train)
+    instrument_utils.count("events", len(start_index))
+    instrument_utils.count("spikes_binned", len(pair))
+    spike_phases = get_spike_phases(phase_signal, spikes, fs, sf)
+    bin_index = np.floor(spike_phases / phase + 1e-9).astype(np.int64) % num_bins
+
+    hist = np.bincount(pair * num_bins + bin_index, minlength = num_pairs * num_bins)
+    return hist.reshape(len(spike_train), len(start_index), num_bins)
+
+'''
+This function is the same with events_all_units, except that phases of spikes are read from an instantaneous phase signal (with sampling frequency fs) with events_signal_phase_hist
+instead of assuming a sine wave for each event. It returns an EventPhaseHist.
+'''
+
+def events_signal_all_units(start_index, end_index, phase_signal, phase, fs, sf, spike_train, outputs = ALL_UNITS_OUTPUTS):
+    spike_train = as_spike_trains(spike_train)
+    counts = events_signal_phase_hist(start_index, end_index, phase_signal, spike_train, phase, fs, sf)
+    spike_lo, spike_hi = get_event_spike_ranges(start_index, end_index, spike_train)
+    bins = get_phase_bins(phase)[1]
+    return EventPhaseHist(counts, bins, phase, start_index, end_index, spike_lo, spike_hi, spike_train, outputs)
+
 '''
 This function takes a frequency spectrum, limit relative power and frequency range and returns the major components of frequency as an array. Output of the get_spectrum function can be used
 in this function to find major frequencies. The function outputs the strongest frequency components that have relative power higher than the limit relative power, as an array.
@@ -221,13 +1028,238 @@ def get_major_freq(major_freqs):
 
 '''
 This function is for plotting the raw data in a specific time limit, taking data, time, xlabel, ylabel, title, and time limit as input.
+Only the min/max envelope of the data that fits the width of the plot is drawn (see DecimationPyramid), so long recordings can be plotted; times should be evenly spaced.
 '''
 
 def plot_data(data, times, xlabel, ylabel, title, time_limit):
     fig, ax = plt.subplots(1, 1)
-    plt.plot(times, data, lw=1.5, color='k')
+    plot_trace(get_pyramid(data, 1 / (times[1] - times[0]), times[0], ax), time_limit, ax = ax, lw=1.5, color='k')
     plt.xlabel(xlabel)
     plt.ylabel(ylabel)
     plt.xlim(time_limit)
     plt.title(title)
     plt.show()
+
+'''
+This class is a min/max decimation pyramid of a trace (1-D array-like, e.g. a channel of a Recording) sampled at fs and starting at start_time (in seconds), for plotting long traces.
+Level k (k >= 1) holds the minimum and maximum of every block of factor ** k samples and is built from level k - 1, so the pyramid is built once with a single pass over the data,
+chunk_size samples at a time, and takes about 2 / (factor - 1) of the memory of the trace. get_line returns the envelope of the coarsest level which still has about two points per pixel
+in the requested time range, so a plot of hours of data only draws a few thousand points.
+'''
+
+class DecimationPyramid:
+    def __init__(self, data, fs, start_time = 0, factor = 8, chunk_size = 2 ** 22):
+        self.data = data
+        self.fs = fs
+        self.start_time = start_time
+        self.factor = factor
+        self.levels = []
+        chunk_size = max(chunk_size // factor, 1) * factor
+        if len(data) <= 2 * factor:
+            return
+        mins, maxs = [], []
+        for start in range(0, len(data), chunk_size):
+            chunk = np.asarray(data[start:start + chunk_size])
+            blocks = np.arange(0, len(chunk), factor)
+            mins.append(np.minimum.reduceat(chunk, blocks))
+            maxs.append(np.maximum.reduceat(chunk, blocks))
+        level = [np.concatenate(mins), np.concatenate(maxs)]
+        self.levels.append(level)
+        while len(level[0]) > 2 * factor:
+            blocks = np.arange(0, len(level[0]), factor)
+            level = [np.minimum.reduceat(level[0], blocks), np.maximum.reduceat(level[1], blocks)]
+            self.levels.append(level)
+
+    def __len__(self):
+        return len(self.data)
+
+    # returns [x, y] of a line showing the trace in [first_time, last_time] with about two points per pixel of width; if ranges ([start, end] indexes of disjoint sorted ranges,
+    # e.g. EventIndex.ranges) are given, the parts of the line outside of the ranges are nan
+    def get_line(self, first_time, last_time, width, ranges = None):
+        first = int(np.clip(np.floor((first_time - self.start_time) * self.fs), 0, len(self)))
+        last = int(np.clip(np.ceil((last_time - self.start_time) * self.fs) + 1, first, len(self)))
+        level = 0
+        while level < len(self.levels) and (last - first) / self.factor ** level > 2 * width:
+            level += 1
+
+        if level == 0:
+            index = np.arange(first, last)
+            x = self.start_time + index / self.fs
+            y = np.array(self.data[first:last], dtype = np.float64)
+            if ranges is not None:
+                y[~ranges_overlap(ranges, index, index + 1)] = np.nan
+            return [x, y]
+
+        block = self.factor ** level
+        mins, maxs = self.levels[level - 1]
+        blocks = np.arange(first // block, min(-(-last // block), len(mins)))
+        # every block is drawn as a vertical stroke from its minimum to its maximum
+        x = self.start_time + np.stack([blocks * block, blocks * block + block / 2], axis = 1).ravel() / self.fs
+        y = np.stack([mins[blocks], maxs[blocks]], axis = 1).astype(np.float64)
+        if ranges is not None:
+            y[~ranges_overlap(ranges, blocks * block, (blocks + 1) * block)] = np.nan
+        return [x, y.ravel()]
+
+'''
+This function takes disjoint ranges sorted by start ([start, end] indexes, e.g. EventIndex.ranges) and the first and last indexes of intervals, and returns a boolean array which is True
+for the intervals [first:last) which overlap any range.
+'''
+
+def ranges_overlap(ranges, first, last):
+    range_start, range_end = ranges
+    if len(range_start) == 0:
+        return np.zeros(len(first), dtype = bool)
+    # only the last range which starts before the end of an interval can overlap it, since the ranges are disjoint
+    position = np.searchsorted(range_start, last, side = 'left') - 1
+    return (position >= 0) & (range_end[np.maximum(position, 0)] > first)
+
+# pyramids of the traces plotted on every axes, so that plotting the same trace again on the axes doesn't build its pyramid again; they are freed together with the axes
+PYRAMIDS = weakref.WeakKeyDictionary()
+
+'''
+This function returns the DecimationPyramid of data sampled at fs and starting at start_time for plotting on the axes ax (the current axes if None), building it only if it wasn't built
+for the same data on the axes before.
+'''
+
+def get_pyramid(data, fs, start_time = 0, ax = None):
+    ax = plt.gca() if ax is None else ax
+    pyramids = PYRAMIDS.setdefault(ax, {})
+    # the pyramid holds the data, so id(data) can't be reused by other data while it is in the cache
+    key = (id(data), fs, start_time)
+    if key not in pyramids:
+        pyramids[key] = DecimationPyramid(data, fs, start_time)
+    return pyramids[key]
+
+'''
+This function takes a DecimationPyramid, a time limit [first, last] and the other arguments of ax.plot and plots the trace on the axes ax (the current axes if None). The line is
+rebuilt from the pyramid whenever the time limit of the axes changes (e.g. zooming in an interactive notebook plot), so only the points that fit the width of the axes are drawn.
+If ranges are given, only the parts of the trace inside the ranges are drawn (see DecimationPyramid.get_line).
+'''
+
+def plot_trace(pyramid, time_limit, ranges = None, ax = None, **kwargs):
+    ax = plt.gca() if ax is None else ax
+    width = max(int(ax.bbox.width), 100)
+    line, = ax.plot(*pyramid.get_line(time_limit[0], time_limit[1], width, ranges), **kwargs)
+
+    def update(ax):
+        first, last = ax.get_xlim()
+        line.set_data(*pyramid.get_line(first, last, max(int(ax.bbox.width), 100), ranges))
+
+    ax.callbacks.connect('xlim_changed', update)
+    return line
+
+'''
+This function takes sorted spike indexes, their sampling frequency, the time of index 0, a time range and a width in pixels, and returns the times of the ticks to draw for the spikes in the time range:
+the spike times if there are fewer spikes than pixels, otherwise one tick for every pixel which has spikes.
+'''
+
+def get_spike_ticks(spike_index, sf, start_time, first_time, last_time, width):
+    lo = np.searchsorted(spike_index, (first_time - start_time) * sf, side = 'left')
+    hi = np.searchsorted(spike_index, (last_time - start_time) * sf, side = 'right')
+    times = start_time + spike_index[lo:hi] / sf
+    if hi - lo <= width or last_time <= first_time:
+        return times
+    pixel_size = (last_time - first_time) / width
+    pixels = np.unique(np.floor((times - first_time) / pixel_size))
+    return first_time + (pixels + 0.5) * pixel_size
+
+'''
+This function plots spikes (sorted spike indexes with sampling frequency sf, index 0 at start_time) as vertical ticks on the axes ax (the current axes if None) in the time limit,
+and draws the ticks again when the time limit of the axes changes.
+'''
+
+def plot_spike_ticks(spike_index, sf, time_limit, start_time = 0, ax = None, **kwargs):
+    ax = plt.gca() if ax is None else ax
+    spike_index = np.asarray(spike_index)
+    ticks = get_spike_ticks(spike_index, sf, start_time, time_limit[0], time_limit[1], max(int(ax.bbox.width), 100))
+    lines = ax.vlines(ticks, 0, 1, **kwargs)
+
+    def update(ax):
+        first, last = ax.get_xlim()
+        ticks = get_spike_ticks(spike_index, sf, start_time, first, last, max(int(ax.bbox.width), 100))
+        lines.set_segments([[[tick, 0], [tick, 1]] for tick in ticks])
+
+    ax.callbacks.connect('xlim_changed', update)
+    return lines
+
+# columns of the spindle and slow wave dataFrames which hold times (in seconds) from the start of the data
+EVENT_TIME_COLUMNS = ["Start", "Peak", "End", "NegPeak", "MidCrossing", "PosPeak"]
+
+'''
+This function takes the length of a data, its sampling frequency, a chunk duration and an overlap duration (in seconds) and splits the data into overlapping chunks.
+It returns a list of [start, end, owned_start, owned_end] for every chunk, where start and end are the indexes of the chunk and an event found in the chunk belongs to that chunk
+if its start time (in seconds) is in [owned_start, owned_end). The overlap between two chunks is split in the middle, so every event is owned by a single chunk.
+'''
+
+def get_chunks(length, fs, chunk_duration, overlap_duration):
+    chunk_size = int(chunk_duration * fs)
+    overlap = int(overlap_duration * fs)
+    if chunk_size <= overlap:
+        raise ValueError("chunk_duration should be longer than overlap_duration")
+
+    chunks = []
+    start = 0
+    while start < length:
+        end = min(start + chunk_size, length)
+        owned_start = 0 if start == 0 else (start + overlap / 2) / fs
+        owned_end = np.inf if end == length else (end - overlap / 2) / fs
+        chunks.append([start, end, owned_start, owned_end])
+        if end == length:
+            break
+        start = end - overlap
+    return chunks
+
+'''
+This function takes the output of an event detection of yasa and returns the events as a dataFrame (None if no events were found). Newer versions of yasa return a results object instead of
+a dataFrame, whose summary is the dataFrame; the channel columns it adds for single channel data are dropped, so the events look the same with every version.
+'''
+
+def get_event_table(events):
+    if events is None:
+        return None
+    if hasattr(events, 'summary'):
+        events = events.summary()
+    return events.drop(columns = [column for column in ["Channel", "IdxChannel"] if column in events.columns])
+
+'''
+This function runs an event detection function on a single chunk of data (an element of the output of get_chunks) and returns the events owned by the chunk, with their times
+shifted to the time of the whole data. It returns None if there are no such events.
+'''
+
+def detect_chunk(detect, data, fs, chunk):
+    start, end, owned_start, owned_end = chunk
+    events = get_event_table(detect(np.asarray(data[start:end], dtype = np.float64), fs))
+    instrument_utils.count("samples", end - start)
+    if events is None or len(events) == 0:
+        return None
+
+    events = events.copy()
+    for column in EVENT_TIME_COLUMNS:
+        if column in events.columns:
+            events[column] += start / fs
+    events = events[(events["Start"] >= owned_start) & (events["Start"] < owned_end)]
+    instrument_utils.count("events_detected", len(events))
+    return events if len(events) > 0 else None
+
+'''
+This function runs an event detection function (e.g. find_spindles or find_slowwave) over a long recording in overlapping chunks, so that only one chunk of the data is in
+memory at a time. data can be any 1-D array-like that supports slicing, such as a channel of a Recording (see recording_utils). detect is called as detect(chunk, fs)
+and should return a dataFrame of events with times in seconds (or a yasa results object, see get_event_table, or None if no events are found). chunk_duration and overlap_duration are in seconds; the overlap should be longer
+than the longest event. Times of the events are shifted to the time of the whole recording and each event is kept only by the chunk which owns its start time (see get_chunks),
+so the events in the overlaps are not duplicated. Note that the thresholds of the detection are computed for each chunk separately.
+The output is a single dataFrame of all events sorted by their start time.
+'''
+
+def detect_chunked(detect, data, fs, chunk_duration = 600, overlap_duration = 10):
+    events = [detect_chunk(detect, data, fs, chunk) for chunk in get_chunks(len(data), fs, chunk_duration, overlap_duration)]
+    return merge_events(events)
+
+'''
+This function takes a list of event dataFrames (None for no events) and returns a single dataFrame sorted by the start time of the events, or None if there are no events.
+'''
+
+def merge_events(events, sort_by = ["Start"]):
+    events = [event for event in events if event is not None and len(event) > 0]
+    if len(events) == 0:
+        return None
+    return pd.concat(events).sort_values(sort_by).reset_index(drop = True)
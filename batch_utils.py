@@ -0,0 +1,174 @@
+"""
+Created on Sunday, 18th of October 2026
+
+Contains the functions for running the spindle and slow wave analysis of the pipelines over many recording sessions without a notebook: detection, spike alignment,
+phase histograms and firing rates of every session are computed by a pool of workers and written to disk. Run it as a script with a JSON config:
+
+python batch_utils.py sessions.json --n_jobs 4
+
+where sessions.json looks like
+{"output": "results",
+ "defaults": {"num_channels": 72, "fs": 1250, "sf": 30000, "channel": 12, "events": ["spindles", "slowwaves"]},
+ "sessions": [{"name": "BWRat17_121712", "recording": "BWRat17_121712.eeg", "spikes": "BWRat17_121712_SStable.mat"}]}
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import numpy as np
+from analysis_utils import *
+from recording_utils import *
+from parallel_utils import *
+from spindle_analysis_utils import *
+from slowwave_analysis_utils import *
+from spike_import_utils import *
+import instrument_utils
+
+'''
+Parameters of a session which are used if they are given neither in the session nor in the defaults of the config. start and end are in data points of the recording (end None is the end
+of the recording), units are the units to analyze (all if None, see import_spike_trains), chunk_duration is passed to the chunked detection (the whole data is detected at once if None)
+and spike_variable is the variable of the .mat spike file holding the spike times (in seconds) of every unit. spikes can be any file or directory read by import_spike_trains.
+'''
+
+SESSION_DEFAULTS = {"dtype": "int16", "gain": 1.0, "channel": 0, "start": 0, "end": None, "units": None, "events": ["spindles", "slowwaves"],
+                    "phase": np.pi / 6, "dt": 2, "thresh": {'rel_pow': 0.2, 'corr': 0.65, 'rms': 1.5}, "chunk_duration": 600, "overlap_duration": 10,
+                    "spike_variable": "S_CellFormat"}
+
+'''
+This function takes the path of a JSON config and returns [output, sessions]: the output directory and the list of sessions, each a dictionary of all of its parameters
+(the defaults of the config and SESSION_DEFAULTS are filled in). Every session needs a name, a recording, a spikes file, num_channels, fs and sf.
+'''
+
+def load_config(path):
+    with open(path) as f:
+        config = json.load(f)
+    defaults = dict(SESSION_DEFAULTS, **config.get("defaults", {}))
+    sessions = [dict(defaults, **session) for session in config["sessions"]]
+    for session in sessions:
+        for key in ["name", "recording", "spikes", "num_channels", "fs", "sf"]:
+            if key not in session:
+                raise ValueError("session {0} has no {1}".format(session.get("name", "?"), key))
+    return [config.get("output", "results"), sessions]
+
+'''
+This function runs the analysis of one type of events (spindles or slow waves) of a session on its data and spike trains, and saves the detected events (events.csv), the firing rates
+before, during and after every event (rates.npz) and the phase histograms (phase_hist.npz and, for spindles, envelope_phase_hist.npz, see EventPhaseHist.save) into directory.
+It returns the number of events.
+'''
+
+def run_events(kind, data, spike_train, session, directory):
+    fs, sf, phase, dt = session["fs"], session["sf"], session["phase"], session["dt"]
+    chunk_duration = session["chunk_duration"]
+    with instrument_utils.stage(kind + " detection"):
+        if kind == "spindles":
+            if chunk_duration is None:
+                events = find_spindles(np.asarray(data, dtype = np.float64), fs, thresh = session["thresh"])
+            else:
+                events = find_spindles_chunked(data, fs, session["thresh"], chunk_duration, session["overlap_duration"])
+        elif kind == "slowwaves":
+            if chunk_duration is None:
+                events = find_slowwave(np.asarray(data, dtype = np.float64), fs)
+            else:
+                events = find_slowwave_chunked(data, fs, chunk_duration, session["overlap_duration"])
+        else:
+            raise ValueError("events should be 'spindles' or 'slowwaves'")
+
+    os.makedirs(directory, exist_ok = True)
+    events = get_event_table(events)
+    if events is None or len(events) == 0:
+        open(os.path.join(directory, "events.csv"), 'w').close()
+        return 0
+    events = events.reset_index(drop = True)
+    events.to_csv(os.path.join(directory, "events.csv"), index = False)
+
+    with instrument_utils.stage(kind + " firing rates"):
+        if kind == "spindles":
+            mean_rates, rates = firing_rate_spindle(events, spike_train, sf, dt, per_event = True)
+        else:
+            mean_rates, rates = firing_rate_sw(events, spike_train, sf, dt, per_event = True)
+        np.savez_compressed(os.path.join(directory, "rates.npz"), mean_rates = mean_rates, rates = rates)
+
+    with instrument_utils.stage(kind + " phase histograms"):
+        if kind == "spindles":
+            spindle_all_units(events, phase, sf, spike_train).save(os.path.join(directory, "phase_hist.npz"))
+            spindle_envelope_all_units(events, phase, sf, spike_train).save(os.path.join(directory, "envelope_phase_hist.npz"))
+        else:
+            sw_all_units(events, phase, sf, spike_train).save(os.path.join(directory, "phase_hist.npz"))
+    return len(events)
+
+'''
+This function runs the whole analysis of a session (a dictionary from load_config) and writes its results into output/name: a directory for every type of events (see run_events),
+the stage timings of the session (profile.csv, see instrument_utils) and summary.json, which is written last and marks the session as done. Errors are written into summary.json
+instead of being raised, so that one broken session doesn't stop the others. Sessions which are already done are skipped unless overwrite is True. It returns the summary.
+'''
+
+def run_session(session, output, overwrite = False):
+    directory = os.path.join(output, session["name"])
+    summary_path = os.path.join(directory, "summary.json")
+    if not overwrite and os.path.exists(summary_path):
+        with open(summary_path) as f:
+            summary = json.load(f)
+        if summary.get("status") == "done":
+            return dict(summary, status = "skipped")
+
+    os.makedirs(directory, exist_ok = True)
+    summary = {"name": session["name"], "status": "done", "events": {}}
+    begin = time.time()
+    instrument_utils.reset_profiling()
+    instrument_utils.enable_profiling()
+    try:
+        with instrument_utils.stage("loading"):
+            recording = load_recording(session["recording"], session["num_channels"], session["fs"], session["dtype"], session["gain"])
+            end = len(recording) if session["end"] is None else min(session["end"], len(recording))
+            data = recording.channel(session["channel"])[session["start"]:end]
+            length = convert_length(len(data), session["fs"], session["sf"])
+            spike_train = import_spike_trains(session["spikes"], session["sf"], length, session["start"] / session["fs"], session["units"], session["spike_variable"])
+        summary["num_units"] = len(spike_train)
+        summary["duration"] = len(data) / session["fs"]
+
+        for kind in session["events"]:
+            summary["events"][kind] = run_events(kind, data, spike_train, session, os.path.join(directory, kind))
+    except Exception as error:
+        summary["status"] = "error"
+        summary["error"] = "{0}: {1}".format(type(error).__name__, error)
+        summary["traceback"] = traceback.format_exc()
+    finally:
+        instrument_utils.disable_profiling()
+    summary["time"] = time.time() - begin
+    instrument_utils.save_report(os.path.join(directory, "profile.csv"))
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent = 1)
+    return summary
+
+'''
+This function runs run_session for every session with a pool of n_jobs workers (see map_tasks in parallel_utils), so at most n_jobs sessions are analyzed at the same time,
+and returns the summaries of the sessions. Use the 'process' backend; with 'thread' the stage timings of sessions running at the same time are mixed.
+'''
+
+def run_batch(sessions, output, backend = 'process', n_jobs = None, overwrite = False):
+    os.makedirs(output, exist_ok = True)
+    tasks = [[session, output, overwrite] for session in sessions]
+    summaries = map_tasks(run_session, tasks, backend, n_jobs)
+    with open(os.path.join(output, "summary.json"), 'w') as f:
+        json.dump(summaries, f, indent = 1)
+    return summaries
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Runs the spindle and slow wave analysis over the sessions of a JSON config.")
+    parser.add_argument("config", help = "JSON file of the sessions")
+    parser.add_argument("--output", help = "directory to write the results to (the output of the config if not given)")
+    parser.add_argument("--n_jobs", type = int, default = None, help = "number of sessions analyzed at the same time (number of cores if not given)")
+    parser.add_argument("--backend", default = 'process', choices = ['serial', 'thread', 'process'])
+    parser.add_argument("--overwrite", action = "store_true", help = "analyze the sessions which are already done again")
+    arguments = parser.parse_args()
+
+    output, sessions = load_config(arguments.config)
+    output = arguments.output if arguments.output else output
+    summaries = run_batch(sessions, output, arguments.backend, arguments.n_jobs, arguments.overwrite)
+    for summary in summaries:
+        message = summary.get("error", ", ".join("{0} {1}".format(count, kind) for kind, count in summary.get("events", {}).items()))
+        print("{0:<30} {1:<8} {2}".format(summary["name"], summary["status"], message))
+    sys.exit(1 if any(summary["status"] == "error" for summary in summaries) else 0)
@@ -0,0 +1,299 @@
+"""
+Created on Sunday, 18th of October 2026
+
+Contains the functions for benchmarking the analysis on synthetic recordings with planted spindles, slow waves and phase-locked spike trains, so that changes which make the
+analysis slower or use more memory can be found. Run it as a script (python benchmark_utils.py --output results.json --baseline baseline.json) to save the timings
+and compare them with an earlier run; it exits with an error if a benchmark is slower than the baseline or fails.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import platform
+import tracemalloc
+import numpy as np
+import pandas as pd
+import scipy.io as spio
+from analysis_utils import *
+from spindle_analysis_utils import *
+from slowwave_analysis_utils import *
+from stats_utils import *
+from spike_utils import *
+from realtime_utils import *
+from coupling_utils import *
+from spike_import_utils import *
+
+'''
+Sizes of the synthetic recordings the benchmarks are run on: duration in seconds, number of LFP channels and number of units. QUICK_CONFIGS are small enough to run in a few seconds.
+'''
+
+DEFAULT_CONFIGS = [{"duration": 60, "num_channels": 1, "num_units": 10},
+                   {"duration": 600, "num_channels": 4, "num_units": 70},
+                   {"duration": 3600, "num_channels": 4, "num_units": 70}]
+QUICK_CONFIGS = [{"duration": 30, "num_channels": 1, "num_units": 5}]
+
+'''
+This function takes the start times of events (in seconds), their durations and frequencies and returns an event dataFrame in the format of find_spindles and find_slowwave.
+'''
+
+def get_planted_events(start, duration, freq):
+    start = np.asarray(start, dtype = np.float64)
+    duration = np.asarray(duration, dtype = np.float64)
+    return pd.DataFrame({"Start": start, "Peak": start + duration / 2, "End": start + duration, "Duration": duration,
+                         "Frequency": np.asarray(freq, dtype = np.float64), "NegPeak": start + duration / 4})
+
+'''
+This function generates a synthetic LFP recording of duration seconds with num_channels channels and sampling frequency fs, and returns [data, sp, sw]: data is a (channels x samples) array
+and sp and sw are the dataFrames of the planted spindles and slow waves. Every channel is Gaussian noise plus a slow oscillation (generate_sinwave), and every spindle is a burst of
+generate_sinsinwave (a sine wave of the spindle frequency under a half-cycle envelope of the spindle duration) added on top of it. Spindles and slow waves are planted every 1 / rate seconds on average.
+'''
+
+def generate_recording(duration, fs, num_channels = 1, rate = 0.2, seed = 0):
+    rng = np.random.default_rng(seed)
+    length = int(duration * fs)
+    num_events = max(int(duration * rate), 1)
+
+    sp_duration = rng.uniform(0.5, 2, num_events)
+    sp_start = np.sort(rng.uniform(0, duration - 2, num_events))
+    sp = get_planted_events(sp_start, sp_duration, rng.uniform(12, 15, num_events))
+    sw_freq = rng.uniform(0.5, 1.25, num_events)
+    sw = get_planted_events(np.sort(rng.uniform(0, duration - 2, num_events)), 1 / sw_freq, sw_freq)
+
+    data = np.empty((num_channels, length))
+    for channel in range(num_channels):
+        data[channel] = rng.normal(0, 10, length) + generate_sinwave(0.8, length, fs, 40)
+        for start, spindle_duration, freq in zip(sp["Start"], sp["Duration"], sp["Frequency"]):
+            first = int(start * fs)
+            size = min(int(spindle_duration * fs), length - first)
+            data[channel, first:first + size] += generate_sinsinwave(freq, 1 / (2 * spindle_duration), size, fs, 60)
+    return [data, sp, sw]
+
+'''
+This function generates Poisson spike trains of num_units units for a recording of length data points with sampling frequency sf, and returns them as a SpikeTrains.
+Every unit fires at rate Hz, and locked_rate Hz more inside the events, at the preferred phase (in radians) of a sine wave with the frequency of the event starting at its start,
+as assumed by spindle_all_units and sw_all_units.
+'''
+
+def generate_spike_trains(events, num_units, length, sf, rate = 5, locked_rate = 20, preferred_phase = np.pi / 2, seed = 0):
+    rng = np.random.default_rng(seed)
+    start_index, end_index = get_event_indexes(events, sf)
+    freq = np.asarray(events["Frequency"], dtype = np.float64)
+    units = []
+    for unit in range(num_units):
+        background = rng.integers(0, length, rng.poisson(rate * length / sf))
+        # every event gets a Poisson number of spikes, placed at the preferred phase of random cycles of the event
+        num_locked = rng.poisson(locked_rate * (end_index - start_index) / sf)
+        event = np.repeat(np.arange(len(start_index)), num_locked)
+        num_cycles = np.maximum(((end_index - start_index) * freq / sf).astype(np.int64), 1)
+        cycle = np.floor(rng.random(len(event)) * num_cycles[event])
+        locked = start_index[event] + ((cycle + preferred_phase / (2 * np.pi)) * sf / freq[event]).astype(np.int64)
+        units.append(np.clip(np.concatenate([background, locked]), 0, length - 1))
+    return get_spike_trains(units, length)
+
+'''
+This function calls function(*args) repeat times and returns its best run time (in seconds) and the peak memory allocated during the first call (in bytes, measured with tracemalloc,
+which numpy reports its arrays to). An exception is recorded as the error of the benchmark instead of stopping the other benchmarks.
+'''
+
+def measure(function, args, repeat = 3):
+    try:
+        tracemalloc.start()
+        function(*args)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            function(*args)
+            times.append(time.perf_counter() - start)
+        return {"time": min(times), "peak_memory": peak_memory}
+    except Exception as error:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        return {"time": None, "peak_memory": None, "error": "{0}: {1}".format(type(error).__name__, error)}
+
+'''
+This function saves spike trains with sampling frequency sf into directory in the formats read by import_spike_trains, a .mat file of spike times (S_CellFormat) and a Kilosort/Phy
+output directory, and returns [mat_path, phy_path].
+'''
+
+def save_spike_files(spike_train, sf, directory):
+    cells = np.empty((1, len(spike_train)), dtype = object)
+    for unit in range(len(spike_train)):
+        cells[0, unit] = (spike_train.unit(unit) / sf).reshape(-1, 1)
+    mat_path = os.path.join(directory, "spikes.mat")
+    spio.savemat(mat_path, {"S_CellFormat": cells})
+    phy_path = os.path.join(directory, "phy")
+    os.makedirs(phy_path, exist_ok = True)
+    order = np.argsort(spike_train.indices, kind = 'stable')
+    np.save(os.path.join(phy_path, "spike_times.npy"), spike_train.indices[order].astype(np.uint64))
+    np.save(os.path.join(phy_path, "spike_clusters.npy"), np.repeat(np.arange(len(spike_train)), spike_train.num_spikes())[order].astype(np.int32))
+    with open(os.path.join(phy_path, "params.py"), 'w') as f:
+        f.write("sample_rate = {0}\n".format(float(sf)))
+    return [mat_path, phy_path]
+
+'''
+This function takes a synthetic recording and spike trains and returns the benchmarks to run on them as a list of [name, function, args]. The spike files of the importer benchmarks
+are written into directory (they are not run if it is None). Chunked detection uses chunks of a quarter of the recording (at least 15 seconds).
+'''
+
+def get_benchmarks(data, sp, sw, spike_train, fs, sf, directory = None):
+    phase = np.pi / 6
+    thresh = {'rel_pow': 0.2, 'corr': 0.65, 'rms': 1.5}
+    chunk_duration = max(data.shape[1] / fs / 4, 15)
+    sp_start, sp_end = get_event_indexes(sp, sf)
+    import_benchmarks = []
+    if directory is not None:
+        mat_path, phy_path = save_spike_files(spike_train, sf, directory)
+        import_benchmarks = [["import_spike_trains_mat", import_spike_trains, [mat_path, sf, spike_train.length]],
+                             ["import_spike_trains_phy", import_spike_trains, [phy_path, sf, spike_train.length]]]
+    return [["find_spindles", find_spindles, [data[0], fs]],
+            ["find_slowwave", find_slowwave, [data[0], fs]],
+            ["find_spindles_chunked", find_spindles_chunked, [data[0], fs, thresh, chunk_duration, 5]],
+            ["find_slowwave_chunked", find_slowwave_chunked, [data[0], fs, chunk_duration, 5]],
+            ["find_spindles_multichannel", find_spindles_multichannel, [data, fs, None, thresh, chunk_duration, 5, 'process']],
+            ["find_slowwave_multichannel", find_slowwave_multichannel, [data, fs, None, chunk_duration, 5, 'process']],
+            ["find_peaks", find_peaks, [data[0], 5]],
+            ["detect_spikes", detect_spikes, [data[0], fs, 5, 1e-3, None]],
+            ["get_spectrum", get_spectrum, [data[0], fs]],
+            ["welch_spectrum", welch_spectrum, [data, fs]],
+            ["multitaper_spectrum", multitaper_spectrum, [data, fs]],
+            ["get_spike_trains", get_spike_trains, [[spike_train.unit(unit) for unit in range(len(spike_train))], spike_train.length]],
+            ["get_envelope_wave", get_envelope_wave, [data[0]]],
+            ["get_analytic_signal", get_analytic_signal, [data[0], fs, 600]],
+            ["spindle_phase_hist", spindle_phase_hist, [sp, phase, sf, spike_train[0]]],
+            ["spindle_all_units", spindle_all_units, [sp, phase, sf, spike_train]],
+            ["spindle_all_units_thread", spindle_all_units, [sp, phase, sf, spike_train, 'thread']],
+            ["spindle_all_units_process", spindle_all_units, [sp, phase, sf, spike_train, 'process']],
+            ["time_warped_hist", time_warped_hist, [sp["Start"], sp["End"], spike_train, sf, 12]],
+            ["spindle_hilbert_all_units", spindle_hilbert_all_units, [sp, phase, sf, spike_train, data[0], fs]],
+            ["spindle_hilbert_all_units_cached", spindle_hilbert_all_units, [sp, phase, sf, spike_train, data[0], fs, [12, 15], False, PhaseCache(fs)]],
+            ["spindle_envelope_all_units", spindle_envelope_all_units, [sp, phase, sf, spike_train]],
+            ["firing_rate_spindle", firing_rate_spindle, [sp, spike_train, sf, 1]],
+            ["peth_spindle", peth_spindle, [sp, spike_train, sf]],
+            ["peri_event_raster", peri_event_raster, [sp_start, spike_train, sf, [-1, 1]]],
+            ["spindle_phase_locking", spindle_phase_locking, [sp, sf, spike_train, 1000]],
+            ["slowwave_phase_hist", slowwave_phase_hist, [sw, phase, sf, spike_train[0]]],
+            ["sw_all_units", sw_all_units, [sw, phase, sf, spike_train]],
+            ["firing_rate_sw", firing_rate_sw, [sw, spike_train, sf, 1]],
+            ["sw_hilbert_all_units", sw_hilbert_all_units, [sw, phase, sf, spike_train, data[0], fs]],
+            ["peth_sw", peth_sw, [sw, spike_train, sf]],
+            ["get_coupling", get_coupling, [sp, sw, fs]],
+            ["split_firing_rates", split_firing_rates, [sp, get_coupling(sp, sw, fs), spike_train, sf, 1]],
+            ["get_labeled_spike_trains", get_labeled_spike_trains, [spike_train.indices, np.repeat(np.arange(len(spike_train)), spike_train.num_spikes()), len(spike_train), spike_train.length]]] + import_benchmarks
+
+'''
+This function runs every benchmark on a synthetic recording of every size in configs (LFP with sampling frequency fs, spikes with sampling frequency sf) and returns a list of results
+(dictionaries with the benchmark name, the size, time and peak_memory). Only the benchmarks whose names are in names are run if names is given.
+'''
+
+def run_benchmarks(configs = DEFAULT_CONFIGS, fs = 1250, sf = 20000, repeat = 3, names = None, verbose = True):
+    results = []
+    for config in configs:
+        data, sp, sw = generate_recording(config["duration"], fs, config["num_channels"])
+        length = convert_length(data.shape[1], fs, sf)
+        spike_train = generate_spike_trains(pd.concat([sp, sw], ignore_index = True), config["num_units"], length, sf)
+        directory = tempfile.mkdtemp()
+        try:
+            for name, function, args in get_benchmarks(data, sp, sw, spike_train, fs, sf, directory):
+                if names is not None and name not in names:
+                    continue
+                result = dict(name = name, **config)
+                result.update(measure(function, args, repeat))
+                results.append(result)
+                if verbose:
+                    print(format_result(result))
+        finally:
+            shutil.rmtree(directory, ignore_errors = True)
+    return results
+
+'''
+This function returns a result of run_benchmarks as a line of text.
+'''
+
+def format_result(result):
+    size = "{0}s x {1} channels x {2} units".format(result["duration"], result["num_channels"], result["num_units"])
+    if result["time"] is None:
+        return "{0:<34} {1:<32} {2}".format(result["name"], size, result["error"])
+    return "{0:<34} {1:<32} {2:10.4f} s {3:10.1f} MB".format(result["name"], size, result["time"], result["peak_memory"] / 1024 ** 2)
+
+'''
+These functions save the results of run_benchmarks to a JSON file, together with the versions of python and numpy, and load them back.
+'''
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump({"python": platform.python_version(), "numpy": np.__version__, "results": results}, f, indent = 1)
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+'''
+This function compares results with the results of a baseline run and returns the regressions as a list of [result, baseline_result]: benchmarks of the same name and size
+which are slower than tolerance times the baseline time, or use more than tolerance times the baseline peak memory.
+'''
+
+def compare_results(results, baseline, tolerance = 1.25):
+    baseline = {(r["name"], r["duration"], r["num_channels"], r["num_units"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = baseline.get((result["name"], result["duration"], result["num_channels"], result["num_units"]))
+        if old is None or old["time"] is None or result["time"] is None:
+            continue
+        if result["time"] > tolerance * old["time"] or result["peak_memory"] > tolerance * old["peak_memory"]:
+            regressions.append([result, old])
+    return regressions
+
+'''
+This function replays a synthetic recording of duration seconds with num_channels channels and sampling frequency fs through the OnlineSpindleDetector in blocks of block_size samples,
+as fast as possible, and returns the latency of the blocks (see OnlineSpindleDetector.latency_stats) with the duration of a block, the real-time factor (seconds of recording processed
+per second) and whether the detector keeps up with the stream, i.e. the 99th percentile of the latency is shorter than a block.
+'''
+
+def run_online_benchmark(duration = 120, fs = 1250, num_channels = 72, block_size = 25, seed = 0):
+    data = generate_recording(duration, fs, num_channels, seed = seed)[0].T.copy()
+    detector = OnlineSpindleDetector(fs, num_channels)
+    start = time.perf_counter()
+    events = run_online(detector, replay_blocks(data, block_size))
+    elapsed = time.perf_counter() - start
+    result = dict(duration = duration, fs = fs, num_channels = num_channels, block_size = block_size, spindles = int(np.sum(events["Type"] == "offset")), **detector.latency_stats())
+    result.update({"block_duration": block_size / fs, "realtime_factor": duration / elapsed, "keeps_up": bool(result["p99"] < block_size / fs)})
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Benchmarks the analysis on synthetic recordings.")
+    parser.add_argument("--output", help = "JSON file to save the results to")
+    parser.add_argument("--baseline", help = "JSON file of an earlier run to compare the results with")
+    parser.add_argument("--tolerance", type = float, default = 1.25, help = "slowdown (and memory growth) factor reported as a regression")
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--quick", action = "store_true", help = "run on a small recording only")
+    parser.add_argument("--names", nargs = "*", help = "names of the benchmarks to run (all if not given)")
+    parser.add_argument("--online", action = "store_true", help = "replay a 72 channel recording through the online spindle detector instead")
+    arguments = parser.parse_args()
+
+    if arguments.online:
+        result = run_online_benchmark()
+        print("{0} blocks of {1:.1f} ms x {2} channels: latency mean {3:.3f} ms, p99 {4:.3f} ms, max {5:.3f} ms, {6:.1f} x real time".format(
+            result["blocks"], 1000 * result["block_duration"], result["num_channels"], 1000 * result["mean"], 1000 * result["p99"], 1000 * result["max"], result["realtime_factor"]))
+        if arguments.output:
+            with open(arguments.output, 'w') as f:
+                json.dump(result, f, indent = 1)
+        sys.exit(0 if result["keeps_up"] else 1)
+
+    results = run_benchmarks(QUICK_CONFIGS if arguments.quick else DEFAULT_CONFIGS, repeat = arguments.repeat, names = arguments.names)
+    if arguments.output:
+        save_results(results, arguments.output)
+    regressions = []
+    if arguments.baseline:
+        regressions = compare_results(results, load_results(arguments.baseline), arguments.tolerance)
+        for result, old in regressions:
+            print("regression: {0} (baseline {1:.4f} s, {2:.1f} MB)".format(format_result(result), old["time"], old["peak_memory"] / 1024 ** 2))
+    # a benchmark which raised an error is a broken hot path, e.g. a detector whose output changed format
+    errors = [result for result in results if result["time"] is None]
+    sys.exit(1 if regressions or errors else 0)
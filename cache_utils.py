@@ -0,0 +1,173 @@
+"""
+Created on Sunday, 18th of October 2026
+
+Contains the functions for caching results of the analysis (spindle and slow wave dataFrames, filtered signals, phase histograms) on the disk, so that they are not computed again
+when the analysis is run again with the same inputs.
+"""
+
+import os
+import hashlib
+import numbers
+import tempfile
+import numpy as np
+import pandas as pd
+from analysis_utils import *
+
+'''
+This function takes the path of a data file and returns a fingerprint of the file: its absolute path, size and modification time, and a hash of its first and last megabytes.
+It is much faster than hashing a whole recording of several gigabytes and changes whenever the file is changed.
+'''
+
+def file_fingerprint(path, sample_size = 2 ** 20):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        digest.update(f.read(sample_size))
+        if stat.st_size > sample_size:
+            f.seek(max(stat.st_size - sample_size, sample_size))
+            digest.update(f.read(sample_size))
+    return [path, stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+
+'''
+This function takes any number of parts (numbers, strings, lists, dictionaries, numpy arrays, ...) which describe the inputs of a computation and returns a key (a hex string) for them.
+Dictionaries are sorted by their keys, arrays are hashed by their content and numbers by their value (1, 1.0 and np.float64(1.0) are the same), so the same inputs always give the same key.
+'''
+
+def get_cache_key(*parts):
+    digest = hashlib.sha256()
+
+    def update(part):
+        if isinstance(part, dict):
+            digest.update(b'{')
+            for key in sorted(part, key = str):
+                update(key)
+                update(part[key])
+            digest.update(b'}')
+        elif isinstance(part, (list, tuple)):
+            digest.update(b'[')
+            for item in part:
+                update(item)
+            digest.update(b']')
+        elif isinstance(part, np.ndarray):
+            digest.update(str((part.dtype.str, part.shape)).encode())
+            digest.update(np.ascontiguousarray(part).tobytes())
+        elif isinstance(part, np.generic):
+            update_value(part.item())
+        else:
+            update_value(part)
+        digest.update(b';')
+
+    # numbers are hashed by their value, so that 1, 1.0 and np.float64(1.0) give the same key (integral floats are written as ints, which keeps large ints exact)
+    def update_value(part):
+        if isinstance(part, numbers.Integral) and not isinstance(part, bool):
+            part = int(part)
+        elif isinstance(part, numbers.Real) and not isinstance(part, bool):
+            part = int(part) if float(part).is_integer() else float(part)
+        digest.update(repr(part).encode())
+
+    update(parts)
+    return digest.hexdigest()
+
+'''
+This class stores results of the analysis in a directory, keyed by get_cache_key of their inputs (e.g. file_fingerprint of the data file, channel, sampling frequency and detection thresholds).
+dataFrames are stored as Parquet files (pickle files if no Parquet engine is installed), dictionaries of arrays and arrays as .npz files and EventPhaseHist results with EventPhaseHist.save.
+The total size of the directory is kept under max_bytes by deleting the least recently used entries.
+For example, cache.cached(lambda: find_spindles(data, fs, thresh), file_fingerprint('BWRat17_121712.eeg'), 12, fs, thresh) detects the spindles only the first time it is run.
+'''
+
+class DiskCache:
+    EXTENSIONS = ['.parquet', '.pkl', '.npz', '.result.npz', '.none']
+
+    def __init__(self, directory, max_bytes = 10 * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok = True)
+
+    # returns the path of the entry of the key, None if there isn't one
+    def find(self, key):
+        for extension in self.EXTENSIONS:
+            path = os.path.join(self.directory, key + extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def __contains__(self, key):
+        return self.find(key) is not None
+
+    def load(self, key):
+        path = self.find(key)
+        if path is None:
+            raise KeyError(key)
+        os.utime(path) # marks the entry as recently used
+        if path.endswith('.parquet'):
+            return pd.read_parquet(path)
+        if path.endswith('.pkl'):
+            return pd.read_pickle(path)
+        if path.endswith('.result.npz'):
+            return load_event_phase_hist(path)
+        if path.endswith('.npz'):
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+            return arrays['array'] if list(arrays) == ['array'] else arrays
+        return None
+
+    def save(self, key, value):
+        if isinstance(value, pd.DataFrame):
+            try:
+                self.write(key, '.parquet', lambda f: value.to_parquet(f))
+            except ImportError:
+                self.write(key, '.pkl', lambda f: value.to_pickle(f))
+        elif isinstance(value, EventPhaseHist):
+            self.write(key, '.result.npz', value.save)
+        elif isinstance(value, dict):
+            self.write(key, '.npz', lambda f: np.savez(f, **value))
+        elif isinstance(value, np.ndarray):
+            self.write(key, '.npz', lambda f: np.savez(f, array = value))
+        elif value is None:
+            self.write(key, '.none', lambda f: None)
+        else:
+            raise TypeError("only dataFrames, EventPhaseHist, arrays, dictionaries of arrays and None can be cached")
+        self.evict()
+
+    # writes to a temporary file first, so that an interrupted write never leaves a broken entry
+    def write(self, key, extension, writer):
+        path = os.path.join(self.directory, key + extension)
+        # a unique temporary file, so that processes writing the same key at the same time don't write into each other's file
+        handle, temporary = tempfile.mkstemp(prefix = key + '.', suffix = extension + '.tmp', dir = self.directory)
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                writer(f)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        os.replace(temporary, path)
+
+    # returns the cached result of the inputs (parts), calling compute() and caching its result if it isn't cached yet
+    def cached(self, compute, *parts):
+        key = get_cache_key(*parts)
+        if key in self:
+            return self.load(key)
+        value = compute()
+        self.save(key, value)
+        return value
+
+    # deletes the least recently used entries until the size of the cache is below max_bytes
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith('.tmp') and os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append([stat.st_mtime_ns, stat.st_size, path])
+        entries.sort()
+        total = sum(entry[1] for entry in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
@@ -0,0 +1,116 @@
+"""
+Created on Sunday, 18th of October 2026
+
+Contains the functions for analyzing the coupling between spindles and slow waves: finding the spindles which are nested in or overlap slow waves, the slow wave phase at the peak
+of every spindle, and the phase histograms and firing rates of units split by coupling class.
+"""
+
+import numpy as np
+import pandas as pd
+from analysis_utils import *
+from stats_utils import *
+
+'''
+Coupling classes of spindles: "nested" spindles are completely inside a slow wave, "overlapping" spindles overlap a slow wave without being inside it and "isolated" spindles don't overlap any.
+'''
+
+COUPLING_CLASSES = ["nested", "overlapping", "isolated"]
+
+'''
+This function takes start and end indexes of events (e.g. spindles) and an EventIndex of other events (e.g. slow waves) and returns [event, other]: the positions of the events and the ids
+of the other events for every pair of overlapping events. It is a sweep-line join: the other events which may overlap an event are a contiguous range of the events sorted by start,
+found with two searchsorted calls, so the cost is O(n log m) plus the number of candidates instead of n * m.
+'''
+
+def get_overlapping_pairs(start_index, end_index, index):
+    start_index = np.asarray(start_index, dtype = np.int64)
+    end_index = np.asarray(end_index, dtype = np.int64)
+    # candidates start before the end of the event and come after the last event whose running maximum of ends is before its start
+    lo = np.searchsorted(index.max_end, start_index, side = 'right')
+    hi = np.searchsorted(index.start_index, end_index, side = 'left')
+    counts = np.maximum(hi - lo, 0)
+    event = np.repeat(np.arange(len(start_index)), counts)
+    candidate = get_range_indexes(lo, lo + counts)
+    overlapping = index.end_index[candidate] > start_index[event]
+    return [event[overlapping], index.event_ids[candidate[overlapping]]]
+
+'''
+This function takes the outputs of find_spindles and find_slowwave and the sampling frequency of the data, and returns a dataFrame with a row for every spindle (with the index of sp):
+"SlowWave" is the index of the slow wave the spindle is coupled to (-1 if isolated), "Coupling" is its class (see COUPLING_CLASSES) and "SlowWavePhase" is the phase (in radians) of the
+slow wave at the peak of the spindle (nan if isolated). If a spindle overlaps several slow waves, the one it is nested in, then the one containing its peak, then the one it overlaps
+most is chosen. If upstate is True, only the up-state of every slow wave (from its "MidCrossing" to its "End") is used instead of the whole slow wave.
+The phase is read from phase_signal (an instantaneous phase signal of the data with sampling frequency fs, e.g. from PhaseCache) if it is given, otherwise every slow wave is taken as
+a sine wave with its "Frequency" starting at phase 0, as in sw_all_units.
+'''
+
+def get_coupling(sp, sw, fs, upstate = False, phase_signal = None):
+    if len(sw) == 0:
+        return pd.DataFrame({"SlowWave": np.full(len(sp), -1, dtype = np.int64), "Coupling": np.full(len(sp), "isolated", dtype = object), "SlowWavePhase": np.full(len(sp), np.nan)}, index = sp.index)
+    sp_start, sp_end = get_event_indexes(sp, fs)
+    peak_time = np.asarray(sp.loc[:,"Peak"], dtype = np.float64) if "Peak" in sp.columns else np.asarray(sp.loc[:,"Start"] + sp.loc[:,"End"], dtype = np.float64) / 2
+    peak = (peak_time * fs).astype(np.int64)
+    sw_start, sw_end = get_event_indexes(sw, fs)
+    if upstate:
+        sw_start = (np.asarray(sw.loc[:,"MidCrossing"], dtype = np.float64) * fs).astype(np.int64)
+
+    # pairs are found with positions of the slow waves as ids, and sorted so that the best slow wave of every spindle comes first
+    spindle, wave = get_overlapping_pairs(sp_start, sp_end, EventIndex(sw_start, sw_end))
+    nested = (sw_start[wave] <= sp_start[spindle]) & (sp_end[spindle] <= sw_end[wave])
+    peak_inside = (sw_start[wave] <= peak[spindle]) & (peak[spindle] < sw_end[wave])
+    overlap = np.minimum(sp_end[spindle], sw_end[wave]) - np.maximum(sp_start[spindle], sw_start[wave])
+    order = np.lexsort((-overlap, ~peak_inside, ~nested, spindle))
+    spindle, wave, nested = spindle[order], wave[order], nested[order]
+    first = np.unique(spindle, return_index = True)[1]
+    spindle, wave, nested = spindle[first], wave[first], nested[first]
+
+    coupled_wave = np.full(len(sp), -1, dtype = np.int64)
+    coupled_wave[spindle] = wave
+    coupling = np.full(len(sp), "isolated", dtype = object)
+    coupling[spindle] = np.where(nested, "nested", "overlapping")
+    wave_phase = np.full(len(sp), np.nan)
+    if phase_signal is not None:
+        wave_phase[spindle] = np.asarray(phase_signal[np.clip(peak[spindle], 0, len(phase_signal) - 1)], dtype = np.float64)
+    else:
+        freq = np.asarray(sw.loc[:,"Frequency"], dtype = np.float64)
+        wave_time = np.asarray(sw.loc[:,"Start"], dtype = np.float64)
+        wave_phase[spindle] = np.mod(2 * np.pi * freq[wave] * (peak_time[spindle] - wave_time[wave]), 2 * np.pi)
+
+    wave_ids = np.asarray(sw.index)
+    return pd.DataFrame({"SlowWave": np.where(coupled_wave >= 0, wave_ids[np.maximum(coupled_wave, 0)], -1), "Coupling": coupling, "SlowWavePhase": wave_phase}, index = sp.index)
+
+'''
+This function takes the output of get_coupling and returns a dataFrame with a row for every coupling class: the number and fraction of spindles in it, and the circular statistics
+(see circular_stats) of the slow wave phases at the peaks of its spindles.
+'''
+
+def coupling_summary(coupling):
+    classes = pd.Categorical(coupling.loc[:,"Coupling"], categories = COUPLING_CLASSES).codes
+    phases = np.asarray(coupling.loc[:,"SlowWavePhase"], dtype = np.float64)
+    valid = ~np.isnan(phases)
+    stats = circular_stats(phases[valid], classes[valid], len(COUPLING_CLASSES))
+    num_spindles = np.bincount(classes, minlength = len(COUPLING_CLASSES))
+    summary = pd.DataFrame({"Spindles": num_spindles, "Fraction": num_spindles / max(len(coupling), 1),
+                            "MeanResultantLength": stats["mean_resultant_length"], "PreferredPhase": stats["preferred_phase"], "RayleighP": stats["rayleigh_p"]},
+                           index = COUPLING_CLASSES)
+    return summary
+
+'''
+This function takes the output of spindle_all_units (or any EventPhaseHist of the spindles) and the output of get_coupling, and returns a dictionary with the EventPhaseHist of the spindles
+of every coupling class, so the phase histograms are computed once and only split afterwards. Event ids of the results are the positions of the spindles in sp.
+'''
+
+def split_phase_hist(hist, coupling):
+    classes = np.asarray(coupling.loc[:,"Coupling"])
+    return {name: hist.select_events(classes == name) for name in COUPLING_CLASSES}
+
+'''
+This function takes the spindle dataFrame, the output of get_coupling, the spike trains of all units, their sampling frequency and a time interval dt (in seconds), and returns a
+dictionary with the average firing rates of every unit before, during and after the spindles of every coupling class, as a (units x 3) array (see firing_rate_spindle).
+'''
+
+def split_firing_rates(sp, coupling, spike_train, sf, dt, backend = 'serial', n_jobs = None):
+    start_index, end_index = get_event_indexes(sp, sf)
+    rates = peri_event_rates(start_index, end_index, sp.loc[:,"Duration"], spike_train, sf, dt, backend, n_jobs)
+    classes = np.asarray(coupling.loc[:,"Coupling"])
+    with np.errstate(invalid = 'ignore'):
+        return {name: np.nanmean(rates[:, classes == name], axis = 1) if np.any(classes == name) else np.full((rates.shape[0], 3), np.nan) for name in COUPLING_CLASSES}
@@ -0,0 +1,197 @@
+"""
+Created on Sunday, 18th of October 2026
+
+Contains the functions for measuring where the time of an analysis goes: timers for stages of a pipeline, counters (events processed, spikes binned, ...) and memory high-water marks,
+collected into a summary report. Nothing is measured until profiling is enabled, so the instrumented functions cost a single check when it is disabled.
+"""
+
+import sys
+import json
+import time
+import types
+import functools
+import tracemalloc
+import pandas as pd
+
+'''
+This class holds the measurements of a run. Every stage (a with profiler.stage(name) block or an instrumented function) has a number of calls, a total time (including the stages inside it),
+the high-water mark of the memory allocated since profiling was enabled, reached during the stage (only if memory tracking is enabled, with tracemalloc) and counters added with count while it is the innermost running stage.
+Measurements are only collected in the process which enabled profiling; the workers of the 'process' backend (see parallel_utils) are not measured.
+'''
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.stages = {}
+        self.stack = []
+
+    # starts collecting measurements, memory tracking makes the analysis noticeably slower
+    def enable(self, memory = False):
+        self.enabled = True
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.enabled = False
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.memory = False
+
+    def reset(self):
+        self.stages = {}
+        self.stack = []
+
+    def get_stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {"calls": 0, "time": 0.0, "peak_memory": 0, "counters": {}}
+        return self.stages[name]
+
+    def stage(self, name):
+        if not self.enabled:
+            return NullStage()
+        return Stage(self, name)
+
+    # adds value to the counter key of the innermost running stage (of the stage "total" if there isn't one)
+    def count(self, key, value = 1):
+        if not self.enabled:
+            return
+        counters = self.get_stage(self.stack[-1][0] if self.stack else "total")["counters"]
+        counters[key] = counters.get(key, 0) + int(value)
+
+    # returns the measurements as a dataFrame with one row per stage, sorted by total time
+    def report(self):
+        rows = []
+        for name, stage in self.stages.items():
+            row = {"stage": name, "calls": stage["calls"], "time": stage["time"], "mean_time": stage["time"] / max(stage["calls"], 1)}
+            if self.memory or stage["peak_memory"] > 0:
+                row["peak_memory_mb"] = stage["peak_memory"] / 1024 ** 2
+            row.update(stage["counters"])
+            rows.append(row)
+        if len(rows) == 0:
+            return pd.DataFrame(columns = ["stage", "calls", "time", "mean_time"])
+        return pd.DataFrame(rows).sort_values("time", ascending = False).reset_index(drop = True)
+
+'''
+This class is the context manager returned by Profiler.stage. Stages can be nested; since tracemalloc has a single peak, the peak of every stage is read and reset when the stage starts
+and ends, and carried over to the stage around it.
+'''
+
+class Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        tracing = self.profiler.memory and tracemalloc.is_tracing()
+        if tracing:
+            if self.profiler.stack:
+                self.profiler.stack[-1][1] = max(self.profiler.stack[-1][1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.profiler.stack.append([self.name, 0])
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.start
+        name, peak = self.profiler.stack.pop()
+        if self.profiler.memory and tracemalloc.is_tracing():
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            if self.profiler.stack:
+                self.profiler.stack[-1][1] = max(self.profiler.stack[-1][1], peak)
+        stage = self.profiler.get_stage(name)
+        stage["calls"] += 1
+        stage["time"] += elapsed
+        stage["peak_memory"] = max(stage["peak_memory"], peak)
+        return False
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+'''
+The profiler of the session. The functions below use it.
+'''
+
+profiler = Profiler()
+
+def enable_profiling(memory = False):
+    profiler.enable(memory)
+
+def disable_profiling():
+    profiler.disable()
+
+def reset_profiling():
+    profiler.reset()
+
+def stage(name):
+    return profiler.stage(name)
+
+def count(key, value = 1):
+    profiler.count(key, value)
+
+def get_report():
+    return profiler.report()
+
+'''
+This function saves the report of the run to path, as a JSON file if path ends with .json and as a csv file otherwise, and returns the report.
+'''
+
+def save_report(path):
+    report = get_report()
+    if path.endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump(report.to_dict(orient = 'records'), f, indent = 1)
+    else:
+        report.to_csv(path, index = False)
+    return report
+
+'''
+This decorator measures every call of a function as a stage named name (the name of the function if None). It can be used as @timed or @timed("name").
+'''
+
+def timed(name = None):
+    def decorate(function):
+        stage_name = function.__name__ if name is None else name
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with Stage(profiler, stage_name):
+                return function(*args, **kwargs)
+
+        wrapper.instrumented = True
+        return wrapper
+
+    if callable(name):
+        function, name = name, None
+        return decorate(function)
+    return decorate
+
+'''
+This function wraps the public functions of the analysis modules (analysis_utils, spindle_analysis_utils and slowwave_analysis_utils by default, or the modules in module_names) with timed,
+so that every call of them is a stage of the report. Since the modules import each other with import *, every function is replaced in all loaded modules which refer to it,
+and in namespace (e.g. globals() of a notebook which imported the modules with import *). It returns the number of functions wrapped; calling it again doesn't wrap them twice.
+'''
+
+def instrument(namespace = None, module_names = ["analysis_utils", "spindle_analysis_utils", "slowwave_analysis_utils"]):
+    wrappers = {}
+    for module_name in module_names:
+        module = sys.modules.get(module_name)
+        if module is None:
+            continue
+        for name, value in vars(module).items():
+            if isinstance(value, types.FunctionType) and value.__module__ == module_name and not name.startswith('_') and not getattr(value, 'instrumented', False):
+                wrappers[value] = timed(name)(value)
+
+    targets = [vars(module) for module in list(sys.modules.values()) if module is not None and hasattr(module, '__dict__')]
+    for target in targets + ([namespace] if namespace is not None else []):
+        for name, value in list(target.items()):
+            if isinstance(value, types.FunctionType) and value in wrappers:
+                target[name] = wrappers[value]
+    return len(wrappers)
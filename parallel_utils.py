@@ -0,0 +1,186 @@
+"""
+Created on Sunday, 18th of October 2026
+
+Contains the functions for running the analysis on several cores, specifically detecting events on many channels and analyzing many units at the same time.
+"""
+
+import os
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from analysis_utils import *
+
+'''
+This class shares a numpy array with worker processes without pickling the data. The array is saved once to a file in shared memory (/dev/shm if it exists, the temporary
+directory otherwise) and every process memory-maps that file, so all processes read the same pages. Pickling a SharedArray only pickles the path of the file.
+The process which creates the SharedArray owns the file and should call close() (or use it in a with statement) to delete it.
+'''
+
+class SharedArray:
+    def __init__(self, array):
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        handle, self.path = tempfile.mkstemp(suffix = '.npy', dir = directory)
+        os.close(handle)
+        np.save(self.path, np.ascontiguousarray(array))
+        self.owner = True
+        self.data = None
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.owner = False
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # returns the shared array as a read-only memory map
+    def array(self):
+        if self.data is None:
+            self.data = np.load(self.path, mmap_mode = 'r')
+        return self.data
+
+    def close(self):
+        self.data = None
+        if self.owner and os.path.exists(self.path):
+            os.remove(self.path)
+
+'''
+This function takes a backend ('serial', 'thread' or 'process') and the number of workers (number of cores if None) and returns the executor to run tasks with.
+None is returned for the serial backend.
+'''
+
+def get_executor(backend = 'process', n_jobs = None):
+    n_jobs = os.cpu_count() if n_jobs is None else n_jobs
+    if backend == 'serial':
+        return None
+    if backend == 'thread':
+        return ThreadPoolExecutor(max_workers = n_jobs)
+    if backend == 'process':
+        return ProcessPoolExecutor(max_workers = n_jobs)
+    raise ValueError("backend should be 'serial', 'thread' or 'process'")
+
+'''
+This function calls function(*task) for every task in the tasks list using the given backend and returns the results in the same order with the tasks.
+For the process backend, function and the tasks should be picklable (functions defined at the top level of a module, SharedArray, Recording, ...).
+'''
+
+def map_tasks(function, tasks, backend = 'process', n_jobs = None):
+    executor = get_executor(backend, n_jobs)
+    if executor is None:
+        return [function(*task) for task in tasks]
+    with executor:
+        futures = [executor.submit(function, *task) for task in tasks]
+        return [future.result() for future in futures]
+
+'''
+This class shares a SpikeTrains with worker processes in the same way with SharedArray: spike indexes and offsets are put into shared memory once and
+every worker maps them, so the spikes are never pickled. spike_trains() returns a SpikeTrains reading the shared arrays.
+'''
+
+class SharedSpikeTrains:
+    def __init__(self, spike_train):
+        self.indices = SharedArray(spike_train.indices)
+        self.offsets = SharedArray(spike_train.offsets)
+        self.length = spike_train.length
+
+    def spike_trains(self):
+        return SpikeTrains(self.indices.array(), self.offsets.array(), self.length)
+
+    def close(self):
+        self.indices.close()
+        self.offsets.close()
+
+'''
+This function is run by the workers of map_units. It calls function on the units [first:last] of the spike trains (a SpikeTrains or SharedSpikeTrains).
+'''
+
+def run_on_units(function, source, first, last, kwargs):
+    if isinstance(source, SharedSpikeTrains):
+        source = source.spike_trains()
+    return function(spike_train = source[first:last], **kwargs)
+
+'''
+This function takes a function which returns an array with one row per unit (e.g. events_phase_hist or peri_event_rates), the spike trains of all units (list of dense spike trains or SpikeTrains)
+and the other arguments of the function as a dictionary, and calls function(spike_train = spike_train, **kwargs) with the units split across the workers of the given backend.
+Units are split into groups with similar numbers of spikes and the results of the groups are put together in the order of the units, so the output is the same with calling the function once.
+With the process backend the spikes are shared through shared memory (SharedSpikeTrains) instead of being pickled for every worker.
+'''
+
+def map_units(function, spike_train, kwargs, backend = 'process', n_jobs = None):
+    spike_train = as_spike_trains(spike_train)
+    n_jobs = os.cpu_count() if n_jobs is None else n_jobs
+    num_groups = min(n_jobs, len(spike_train))
+    if backend == 'serial' or num_groups <= 1:
+        return function(spike_train = spike_train, **kwargs)
+
+    # group boundaries are chosen so that every group has about the same number of spikes, empty groups are dropped
+    targets = np.linspace(0, spike_train.offsets[-1], num_groups + 1)
+    bounds = np.searchsorted(spike_train.offsets, targets)
+    bounds[-1] = len(spike_train)
+    bounds = np.unique(bounds)
+
+    source = SharedSpikeTrains(spike_train) if backend == 'process' else spike_train
+    try:
+        tasks = [[function, source, bounds[i], bounds[i + 1], kwargs] for i in range(len(bounds) - 1)]
+        results = map_tasks(run_on_units, tasks, backend, n_jobs)
+    finally:
+        if isinstance(source, SharedSpikeTrains):
+            source.close()
+    return np.concatenate(results, axis = 0)
+
+'''
+This function takes a multichannel data source and a channel index and returns the data of the channel without reading it into memory. The source can be a Recording
+(see recording_utils, samples x channels), a SharedArray or an array of shape (channels x samples).
+'''
+
+def get_channel(source, channel):
+    if isinstance(source, SharedArray):
+        return source.array()[channel]
+    if hasattr(source, 'channel'):
+        return source.channel(channel)
+    return source[channel]
+
+'''
+This function is run by the workers of detect_multichannel. It detects the events in one chunk of one channel and returns them tagged with the channel index.
+'''
+
+def detect_channel_chunk(detect, source, channel, fs, chunk):
+    events = detect_chunk(detect, get_channel(source, channel), fs, chunk)
+    if events is not None:
+        events.insert(0, "Channel", channel)
+    return events
+
+'''
+This function runs an event detection function (e.g. find_spindles or find_slowwave) on several channels of a recording in parallel. data can be a memory-mapped Recording
+(see recording_utils), which the workers map again by themselves, or an array of shape (channels x samples), which is put into shared memory once instead of being pickled for every task.
+Every channel is split into overlapping chunks of chunk_duration seconds (the whole channel is a single chunk if chunk_duration is None), and every (channel, chunk) pair is a separate task,
+so even a few long channels keep all workers busy. The output is a single dataFrame of the events of all channels, with the channel index in the "Channel" column, sorted by channel and start time.
+'''
+
+def detect_multichannel(detect, data, fs, channels = None, chunk_duration = None, overlap_duration = 10, backend = 'process', n_jobs = None):
+    if hasattr(data, 'channel'):
+        num_channels, length = data.num_channels, len(data)
+    else:
+        num_channels, length = np.shape(data)
+    channels = range(num_channels) if channels is None else channels
+    if chunk_duration is None:
+        chunks = [[0, length, 0, np.inf]]
+    else:
+        chunks = get_chunks(length, fs, chunk_duration, overlap_duration)
+
+    source = data
+    if backend == 'process' and not hasattr(data, 'channel'):
+        source = SharedArray(data)
+    try:
+        tasks = [[detect, source, channel, fs, chunk] for channel in channels for chunk in chunks]
+        events = map_tasks(detect_channel_chunk, tasks, backend, n_jobs)
+    finally:
+        if isinstance(source, SharedArray):
+            source.close()
+    return merge_events(events, sort_by = ["Channel", "Start"])
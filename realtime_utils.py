@@ -0,0 +1,279 @@
+"""
+Created on Sunday, 18th of October 2026
+
+Contains the functions for detecting spindles online, as the samples of a recording arrive, for closed-loop experiments: blocks of samples from a stream (a file replay or a local socket)
+are filtered with incremental filter states, kept in a ring buffer, and spindle onsets, offsets and the current spindle phase are emitted as events after every block, with the
+processing time of every block tracked. Run it as a script to replay a recording (python realtime_utils.py BWRat17_121712.eeg --num_channels 72 --fs 1250) and print the latency.
+"""
+
+import sys
+import time
+import socket
+import argparse
+import numpy as np
+import pandas as pd
+from scipy import signal
+from analysis_utils import *
+from recording_utils import *
+
+'''
+This class holds the last size samples of num_channels channels, with the newest sample at the end. Blocks are written into a preallocated array in place, so no memory is allocated per block.
+'''
+
+class RingBuffer:
+    def __init__(self, size, num_channels):
+        self.data = np.zeros((size, num_channels))
+        self.size = size
+        self.position = 0
+        self.count = 0
+
+    # writes a block of samples (samples x channels), only its last size samples are kept if it is longer than the buffer
+    def write(self, block):
+        block = block[-self.size:]
+        first = min(len(block), self.size - self.position)
+        self.data[self.position:self.position + first] = block[:first]
+        self.data[:len(block) - first] = block[first:]
+        self.position = (self.position + len(block)) % self.size
+        self.count = min(self.count + len(block), self.size)
+
+    # returns the last n samples (at most the number of samples written) in order, as an array of shape (n x channels)
+    def latest(self, n):
+        n = min(n, self.count)
+        return self.data[(np.arange(self.position - n, self.position)) % self.size]
+
+'''
+This class detects the spindles of num_channels channels sampled at fs online. process takes the next block of samples (samples x channels), which can have any number of samples,
+and returns the events of the block as a list of dictionaries with the "Type" of the event, its "Channel" and "Time" (in seconds since the first sample):
+- "onset": the spindle criteria have held for onset_duration seconds, "Start" is the time they started to hold,
+- "offset": the criteria stopped holding after an onset, with "Start", "End", "Duration" and "Valid" (True if the duration is in duration, as in find_spindles),
+- "phase": emitted after every block for every channel in a spindle, "Phase" is the phase (in radians, see get_instantaneous_phase: 0 where the wave crosses zero going up, as in phase_hist) of the spindle band at the last sample of the block
+  and "Amplitude" and "Frequency" its amplitude and instantaneous frequency.
+The criteria follow find_spindles: the relative power of the spindle band (freq_sp) to the broad band (freq_broad) is above thresh['rel_pow'], and the RMS of the spindle band signal is more than
+thresh['rms'] standard deviations above its mean. Powers are smoothed over window seconds and the mean and standard deviation of the RMS over baseline_duration seconds with causal filters,
+whose states are kept between blocks. The correlation criterion of find_spindles needs the whole spindle and is not used.
+The phase is found with an endpoint-corrected Hilbert transform of the last phase_duration seconds in the ring buffer: the spectrum of the analytic signal is multiplied by the frequency
+response of a causal band-pass filter of the spindle band, so the phase at the last sample isn't distorted by the end of the window, and the phase shift of that filter at the instantaneous frequency is removed.
+'''
+
+class OnlineSpindleDetector:
+    def __init__(self, fs, num_channels, freq_sp = [12, 15], freq_broad = [1, 30], thresh = {'rel_pow': 0.2, 'rms': 1.5}, window = 0.3, baseline_duration = 30,
+                 onset_duration = 0.2, duration = [0.5, 2], phase_duration = 1):
+        self.fs = fs
+        self.num_channels = num_channels
+        self.thresh = thresh
+        self.duration = duration
+        self.onset_size = max(int(onset_duration * fs), 1)
+        self.phase_size = max(int(phase_duration * fs), 2)
+        self.buffer = RingBuffer(self.phase_size, num_channels)
+
+        self.sos_sp = signal.butter(4, freq_sp, 'bandpass', fs = fs, output = 'sos')
+        self.sos_broad = signal.butter(4, freq_broad, 'bandpass', fs = fs, output = 'sos')
+        self.zi_sp = np.zeros((self.sos_sp.shape[0], 2, num_channels))
+        self.zi_broad = np.zeros((self.sos_broad.shape[0], 2, num_channels))
+        # one-pole smoothing filters y[n] = a * y[n - 1] + (1 - a) * x[n] of the powers and of the RMS statistics
+        self.a_power = np.exp(-1 / (window * fs))
+        self.a_baseline = np.exp(-1 / (baseline_duration * fs))
+        self.zi_power = np.zeros((2, 1, num_channels))
+        self.zi_baseline = np.zeros((2, 1, num_channels))
+        self.num_samples = 0
+
+        # frequency response of the causal band-pass filter of the endpoint-corrected Hilbert transform on the non-negative frequencies of the rfft, together with the
+        # analytic signal mask, and the inverse DFT of the last sample of the window and of the sample frequency_size samples before it, the only samples the phase needs
+        self.sos_phase = signal.butter(2, freq_sp, 'bandpass', fs = fs, output = 'sos')
+        self.frequency_size = max(int(0.02 * fs), 1)
+        num_frequencies = self.phase_size // 2 + 1
+        response = signal.sosfreqz(self.sos_phase, worN = self.phase_size, whole = True)[1][:num_frequencies]
+        analytic = np.full(num_frequencies, 2.0)
+        analytic[0] = 1
+        if self.phase_size % 2 == 0:
+            analytic[-1] = 1
+        samples = np.array([self.phase_size - 1, self.phase_size - 1 - self.frequency_size])
+        self.phase_filter = (analytic * response)[:, None] * np.exp(2j * np.pi * np.outer(np.arange(num_frequencies), samples) / self.phase_size) / self.phase_size
+
+        # run_start is the sample the criteria started to hold on every channel (-1 if they don't hold), onset is True if the onset of the spindle was emitted
+        self.run_start = np.full(num_channels, -1, dtype = np.int64)
+        self.onset = np.zeros(num_channels, dtype = bool)
+        self.phase = np.full(num_channels, np.nan)
+        self.amplitude = np.full(num_channels, np.nan)
+        self.frequency = np.full(num_channels, np.nan)
+        self.latencies = []
+
+    def smooth(self, x, a, zi):
+        return signal.lfilter([1 - a], [1, -a], x, axis = 0, zi = zi)
+
+    # returns the boolean (samples x channels) array of the samples of the block where the spindle criteria hold
+    def get_criteria(self, block):
+        sp, self.zi_sp = signal.sosfilt(self.sos_sp, block, axis = 0, zi = self.zi_sp)
+        broad, self.zi_broad = signal.sosfilt(self.sos_broad, block, axis = 0, zi = self.zi_broad)
+        sp_power, self.zi_power[0] = self.smooth(sp ** 2, self.a_power, self.zi_power[0])
+        broad_power, self.zi_power[1] = self.smooth(broad ** 2, self.a_power, self.zi_power[1])
+        rms = np.sqrt(sp_power)
+        mean, self.zi_baseline[0] = self.smooth(rms, self.a_baseline, self.zi_baseline[0])
+        mean_square, self.zi_baseline[1] = self.smooth(rms ** 2, self.a_baseline, self.zi_baseline[1])
+        # the smoothed statistics start from 0, so they are divided by the weight of the samples seen so far
+        seen = self.num_samples + np.arange(1, len(block) + 1)[:, None]
+        mean = mean / (1 - self.a_baseline ** seen)
+        std = np.sqrt(np.maximum(mean_square / (1 - self.a_baseline ** seen) - mean ** 2, 0))
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            rel_power = sp_power / broad_power
+        return (rel_power >= self.thresh['rel_pow']) & (rms > mean + self.thresh['rms'] * std)
+
+    # returns the onset and offset events of the block, given the criteria of its samples
+    def get_spindle_events(self, criteria):
+        events = []
+        previous = (self.run_start >= 0)[None, :]
+        changes = np.flatnonzero(np.any(criteria != np.concatenate([previous, criteria[:-1]]), axis = 0) | (previous[0] & ~self.onset))
+        for channel in changes:
+            edges = np.flatnonzero(np.diff(np.concatenate([[self.run_start[channel] >= 0], criteria[:, channel]]).astype(np.int8)))
+            # the criteria hold from every rising edge to the next falling edge; a run which started in an earlier block starts at run_start
+            for edge in list(edges) + [len(criteria)]:
+                if self.run_start[channel] >= 0 and not self.onset[channel]:
+                    onset = self.run_start[channel] + self.onset_size
+                    if onset <= self.num_samples + edge:
+                        self.onset[channel] = True
+                        events.append({"Type": "onset", "Channel": channel, "Time": onset / self.fs, "Start": self.run_start[channel] / self.fs})
+                if edge == len(criteria):
+                    break
+                if criteria[edge, channel]:
+                    self.run_start[channel] = self.num_samples + edge
+                else:
+                    if self.onset[channel]:
+                        start, end = self.run_start[channel] / self.fs, (self.num_samples + edge) / self.fs
+                        events.append({"Type": "offset", "Channel": channel, "Time": end, "Start": start, "End": end, "Duration": end - start,
+                                       "Valid": self.duration[0] <= end - start <= self.duration[1]})
+                    self.run_start[channel] = -1
+                    self.onset[channel] = False
+        return events
+
+    # updates the phase, amplitude and frequency of the spindle band of every channel at the last sample in the ring buffer
+    def update_phase(self):
+        if self.buffer.count < self.buffer.size:
+            return
+        # the rfft is taken along the contiguous axis of the transposed window
+        spectrum = np.fft.rfft(np.ascontiguousarray(self.buffer.latest(self.phase_size).T), axis = 1)
+        last, before = (spectrum @ self.phase_filter).T
+        # the instantaneous frequency is the phase advance over the last frequency_size samples, and the phase shift of the filter at that frequency is removed from the phase
+        self.frequency = np.clip(np.angle(last * np.conj(before)) * self.fs / (2 * np.pi * self.frequency_size), 0, self.fs / 2)
+        self.phase = get_instantaneous_phase(last * np.exp(-1j * np.angle(self.get_response(self.frequency))))
+        self.amplitude = np.abs(last)
+
+    # returns the frequency response of the filter of the phase at the frequencies
+    def get_response(self, frequencies):
+        z = np.exp(-2j * np.pi * np.asarray(frequencies) / self.fs)[:, None]
+        sections = (self.sos_phase[:, 0] + self.sos_phase[:, 1] * z + self.sos_phase[:, 2] * z ** 2) / (self.sos_phase[:, 3] + self.sos_phase[:, 4] * z + self.sos_phase[:, 5] * z ** 2)
+        return np.prod(sections, axis = 1)
+
+    # processes the next block of samples (samples x channels) and returns its events
+    def process(self, block):
+        begin = time.perf_counter()
+        block = np.asarray(block, dtype = np.float64).reshape(-1, self.num_channels)
+        events = []
+        if len(block) > 0:
+            self.buffer.write(block)
+            events = self.get_spindle_events(self.get_criteria(block))
+            self.num_samples += len(block)
+            self.update_phase()
+            block_time = (self.num_samples - 1) / self.fs
+            for channel in np.flatnonzero(self.onset):
+                events.append({"Type": "phase", "Channel": channel, "Time": block_time, "Phase": self.phase[channel], "Amplitude": self.amplitude[channel],
+                               "Frequency": self.frequency[channel]})
+        self.latencies.append(time.perf_counter() - begin)
+        return events
+
+    # returns the processing time of the blocks: their number, mean, median, 99th percentile and maximum (in seconds)
+    def latency_stats(self):
+        latencies = np.asarray(self.latencies)
+        if len(latencies) == 0:
+            return {"blocks": 0, "mean": np.nan, "median": np.nan, "p99": np.nan, "max": np.nan}
+        return {"blocks": len(latencies), "mean": latencies.mean(), "median": np.median(latencies), "p99": np.percentile(latencies, 99), "max": latencies.max()}
+
+'''
+This function yields the samples of data (a Recording or an array of shape samples x channels) in blocks of block_size samples (samples x channels), from start to end (in data points),
+of the channels (all channels if None). If realtime is True, the blocks are yielded at the rate they would arrive from the amplifier (fs samples per second), otherwise as fast as possible.
+'''
+
+def replay_blocks(data, block_size, fs = None, channels = None, start = 0, end = None, realtime = False):
+    end = len(data) if end is None else min(end, len(data))
+    begin = time.perf_counter()
+    for first in range(start, end, block_size):
+        if realtime:
+            delay = begin + (first + block_size - start) / fs - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if isinstance(data, Recording):
+            yield data.read(first, min(first + block_size, end), channels, microvolts = True)
+        else:
+            block = np.asarray(data[first:min(first + block_size, end)])
+            yield block if channels is None else block[:, channels]
+
+'''
+This function connects to a stream of samples on a TCP socket (e.g. the local socket of an acquisition system) which sends interleaved samples of num_channels channels of type dtype,
+as in .eeg files, and yields them in blocks of block_size samples (samples x channels) in microvolts (multiplied by gain), until the stream is closed.
+'''
+
+def socket_blocks(host, port, num_channels, block_size, dtype = 'int16', gain = 1.0):
+    dtype = np.dtype(dtype)
+    sample_bytes = num_channels * dtype.itemsize
+    buffer = bytearray(block_size * sample_bytes)
+    with socket.create_connection((host, port)) as connection:
+        while True:
+            received = 0
+            view = memoryview(buffer)
+            while received < len(buffer):
+                size = connection.recv_into(view[received:])
+                if size == 0:
+                    break
+                received += size
+            num_samples = received // sample_bytes
+            if num_samples > 0:
+                yield np.frombuffer(buffer, dtype = dtype, count = num_samples * num_channels).reshape(num_samples, num_channels) * gain
+            if received < len(buffer):
+                return
+
+'''
+This function runs detector (an OnlineSpindleDetector) on the blocks of a stream (e.g. replay_blocks or socket_blocks) and returns all the events as a dataFrame (see events_to_frame).
+callback is called with the events of every block which has events, e.g. to trigger the stimulation.
+'''
+
+def run_online(detector, blocks, callback = None):
+    events = []
+    for block in blocks:
+        block_events = detector.process(block)
+        if callback is not None and len(block_events) > 0:
+            callback(block_events)
+        events.extend(block_events)
+    return events_to_frame(events)
+
+'''
+This function takes a list of events of OnlineSpindleDetector and returns them as a dataFrame with a row for every event.
+'''
+
+def events_to_frame(events):
+    columns = ["Type", "Channel", "Time", "Start", "End", "Duration", "Valid", "Phase", "Amplitude", "Frequency"]
+    return pd.DataFrame(events, columns = columns)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Replays a recording through the online spindle detector and prints its latency.")
+    parser.add_argument("recording", help = ".eeg or .dat file of the recording")
+    parser.add_argument("--num_channels", type = int, required = True)
+    parser.add_argument("--fs", type = float, default = 1250)
+    parser.add_argument("--dtype", default = 'int16')
+    parser.add_argument("--gain", type = float, default = 1.0)
+    parser.add_argument("--block_size", type = int, default = 25, help = "samples per block")
+    parser.add_argument("--duration", type = float, default = None, help = "seconds of the recording to replay (all if not given)")
+    parser.add_argument("--realtime", action = "store_true", help = "replay at the rate of the recording")
+    parser.add_argument("--output", help = "csv file to save the events to")
+    arguments = parser.parse_args()
+
+    recording = load_recording(arguments.recording, arguments.num_channels, arguments.fs, arguments.dtype, arguments.gain)
+    end = None if arguments.duration is None else int(arguments.duration * arguments.fs)
+    detector = OnlineSpindleDetector(arguments.fs, arguments.num_channels)
+    events = run_online(detector, replay_blocks(recording, arguments.block_size, arguments.fs, end = end, realtime = arguments.realtime))
+    if arguments.output:
+        events.to_csv(arguments.output, index = False)
+
+    stats = detector.latency_stats()
+    block_duration = arguments.block_size / arguments.fs
+    print("{0} spindles, {1} blocks of {2:.1f} ms".format(int(np.sum(events["Type"] == "offset")), stats["blocks"], 1000 * block_duration))
+    print("latency: mean {0:.3f} ms, median {1:.3f} ms, p99 {2:.3f} ms, max {3:.3f} ms".format(*[1000 * stats[key] for key in ["mean", "median", "p99", "max"]]))
+    sys.exit(0 if stats["p99"] < block_duration else 1)
@@ -0,0 +1,85 @@
+"""
+Created on Sunday, 18th of October 2026
+
+Contains the functions for loading multichannel electrophysiological recordings (.eeg/.dat files with interleaved samples) without reading the whole file into memory.
+"""
+
+import numpy as np
+
+'''
+This class memory-maps a recording whose samples are interleaved between channels (sample 0 of every channel, then sample 1 of every channel, ...), as in .eeg and .dat files.
+Nothing is read from the disk until the data is accessed, so selecting channels and time windows only costs the bytes that are actually touched.
+gain is the number of microvolts per unit of the stored integers and is used when scaling to microvolts is requested.
+'''
+
+class Recording:
+    def __init__(self, path, num_channels, fs, dtype = 'int16', gain = 1.0, offset = 0):
+        self.path = path
+        self.num_channels = int(num_channels)
+        self.fs = fs
+        self.dtype = np.dtype(dtype)
+        self.gain = gain
+        self.offset = offset
+        self.open()
+
+    # (re)creates the memory map, the number of samples is found from the size of the file
+    def open(self):
+        data = np.memmap(self.path, dtype = self.dtype, mode = 'r', offset = self.offset)
+        num_samples = len(data) // self.num_channels
+        self.data = np.memmap(self.path, dtype = self.dtype, mode = 'r', offset = self.offset, shape = (num_samples, self.num_channels))
+
+    # only the description of the file is pickled, the memory map is recreated when unpickled (e.g. in another process)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['data']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open()
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    # returns the duration of the recording in seconds
+    def duration(self):
+        return len(self) / self.fs
+
+    # returns a lazy strided view of a channel, no data is read until it is indexed
+    def channel(self, channel):
+        return self.data[:, channel]
+
+    # takes raw data of the recording and returns it in microvolts
+    def to_microvolts(self, data):
+        return np.asarray(data, dtype = np.float64) * self.gain
+
+    # returns the samples in [start:end] of the channels (all channels if None) as an array in memory, in microvolts if microvolts is True
+    def read(self, start = 0, end = None, channels = None, microvolts = False):
+        end = len(self) if end is None else end
+        if channels is None:
+            data = np.array(self.data[start:end])
+        else:
+            data = np.array(self.data[start:end, channels])
+        if microvolts:
+            return self.to_microvolts(data)
+        return data
+
+    # yields [start, chunk] for consecutive chunks of chunk_size samples which overlap each other by overlap samples
+    def iter_chunks(self, chunk_size, channels = None, overlap = 0, start = 0, end = None, microvolts = False):
+        end = len(self) if end is None else min(end, len(self))
+        if chunk_size <= overlap:
+            raise ValueError("chunk_size should be bigger than overlap")
+        while start < end:
+            chunk_end = min(start + chunk_size, end)
+            yield [start, self.read(start, chunk_end, channels, microvolts)]
+            if chunk_end == end:
+                break
+            start = chunk_end - overlap
+
+'''
+This function takes the path of a recording, its number of channels, sampling frequency, data type of the samples and gain (microvolts per unit) as input
+and returns a memory-mapped Recording. For example, load_recording('BWRat17_121712.eeg', 72, 1250).read(0, 5000000, 12) returns the first 5000000 samples of channel 12.
+'''
+
+def load_recording(path, num_channels, fs, dtype = 'int16', gain = 1.0):
+    return Recording(path, num_channels, fs, dtype, gain)
@@ -9,6 +9,8 @@ Contains the functions for analyzing electrophysiological data, specifically fin
 import numpy as np
 from matplotlib import pyplot as plt
 from analysis_utils import *
+from parallel_utils import *
+from stats_utils import *
 import yasa
 
 '''
@@ -24,12 +26,14 @@ def slowwave_phase_hist(sw, phase, fs, spike_train):
     heights = []
     flag = True
     index = 0
+    start_indexes, end_indexes = get_event_indexes(sw, fs)
 
     for freq in sw.loc[:,"Frequency"]:
-        start_index = int(sw.loc[index,"Start"] * fs)
-        end_index = int(sw.loc[index,"End"] * fs)
-        time_spike_trains[str(index)] = spike_train[start_index:end_index]
-        phase_histogram = phase_hist(spike_train[start_index:end_index], freq, phase, fs)
+        start_index = start_indexes[index]
+        end_index = end_indexes[index]
+        window = slice_spike_train(spike_train, start_index, end_index)
+        time_spike_trains[str(index)] = window
+        phase_histogram = phase_hist(window, freq, phase, fs)
         phase_hist_spike_trains[str(index)] = phase_histogram
         if flag:
             bins = phase_histogram[1]
@@ -47,18 +51,33 @@ This function takes a data and its sampling frequency in order to produce a pand
 '''
 
 def find_slowwave(data, fs):
-    return yasa.sw_detect(data, fs)
+    return get_event_table(yasa.sw_detect(data, fs))
+
+'''
+This function takes a long data (e.g. a channel of a memory-mapped Recording) and its sampling frequency and finds the slow waves in overlapping chunks of chunk_duration seconds
+using detect_chunked, so that the whole recording never has to be in memory. It returns a single pandas Dataframe with the times of the slow waves in the whole recording.
+'''
+
+def find_slowwave_chunked(data, fs, chunk_duration = 600, overlap_duration = 10):
+    return detect_chunked(find_slowwave, data, fs, chunk_duration, overlap_duration)
+
+'''
+This function takes a multichannel data (a memory-mapped Recording or an array of shape (channels x samples)) and its sampling frequency and finds the slow waves of the given channels
+(all channels if None) in parallel with detect_multichannel, using a pool of n_jobs workers (number of cores if None). Channels are also split into chunks if chunk_duration is given.
+It returns a single pandas Dataframe of the slow waves of all channels, with the channel index of each one in the "Channel" column.
+'''
+
+def find_slowwave_multichannel(data, fs, channels = None, chunk_duration = None, overlap_duration = 10, backend = 'process', n_jobs = None):
+    return detect_multichannel(find_slowwave, data, fs, channels, chunk_duration, overlap_duration, backend, n_jobs)
 
 '''
 This function is for plotting the slow waves on the top of raw data in a specific time limit, taking data, time, sampling frequency, xlabel, ylabel, title, and time limit as input.
 '''
 
 def plot_slowwave(data, times, fs, sw, xlabel, ylabel, title, time_limit):
-    bool_sw = yasa.get_bool_vector(data, fs, sw)
-    sw_highlight = data * bool_sw
-
-    plt.plot(times, data, 'k')
-    plt.plot(times, sw_highlight, 'indianred')
+    pyramid = get_pyramid(data, fs, times[0])
+    plot_trace(pyramid, time_limit, color = 'k')
+    plot_trace(pyramid, time_limit, get_event_index(sw, fs).ranges, color = 'indianred')
     plt.xlabel(xlabel)
     plt.ylabel(ylabel)
     plt.xlim(time_limit)
@@ -72,79 +91,90 @@ It will save the raw data for each slow wave, in the following format: {'0': [sl
 
 def save_slowwave(data0, fs, sw):
     sw_dict = {}
-    index = 0
-    for start in sw.loc[:,"Start"]:
-        start_index = int(start * fs)
-        end_index = int(sw.loc[index,"End"] * fs)
-        sw_dict[str(index)] = data0[start_index:end_index]
-        index += 1
+    start_index, end_index = get_event_indexes(sw, fs)
+    for index in range(len(start_index)):
+        sw_dict[str(index)] = data0[start_index[index]:end_index[index]]
     return sw_dict
 
 '''
-This function takes the slow wave dataframe, spike_train of every unit, sampling frequency, a time interval in seconds (dt)
+This function takes the slow wave dataframe, spike_train of every unit (list of dense spike trains or SpikeTrains), sampling frequency, a time interval in seconds (dt)
 as input to output the following information about for each unit:
 [Average firing rate of the unit in the following time interval [start - dt:start],
 Average firing rate of the unit in the following time interval [slowwave duration],
 Average firing rate of the unit in the following time interval [end : end + dt]]
 You can access this information by indexing the output array[unit_index]
+Windows are clipped at the edges of the recording and windows completely outside of the recording are left out of the averages.
+If per_event is True, [averages, rates] is returned where rates is a (units x events x 3) array holding the same firing rates for every slow wave.
+Units are analyzed on several cores with backend 'thread' or 'process' and n_jobs workers (see map_units in parallel_utils).
 '''
 
-def firing_rate_sw(sw, spike_train, sf, dt):
-    swhist = []
-    index = 0
-    for i in range(len(spike_train)):
-        ind = 0
-        frs = 0
-        frb = 0
-        fra = 0
-        for freq in sw.loc[:,"Frequency"]:
-            start_index = int(sw.loc[ind,"Start"] * sf)
-            end_index = int(sw.loc[ind,"End"] * sf)
-            duration = sw.loc[ind,"Duration"]
-            for j in spike_train[i][start_index:end_index]:
-                if j == 1:
-                    frs += (1/duration)
-            for j in spike_train[i][int(start_index - dt * sf):start_index]:
-                if j == 1:
-                    frb += (1/dt)
-            for j in spike_train[i][end_index:int(end_index + dt * sf)]:
-                if j == 1:
-                    fra += (1/dt)
-            ind += 1
-
-        swhist.append([frb/ ind, frs/ ind, fra/ ind])
-        index += 1
+def firing_rate_sw(sw, spike_train, sf, dt, per_event = False, backend = 'serial', n_jobs = None):
+    start_index, end_index = get_event_indexes(sw, sf)
+    rates = peri_event_rates(start_index, end_index, sw.loc[:,"Duration"], spike_train, sf, dt, backend, n_jobs)
+    mean_rates = np.nanmean(rates, axis = 1)
+    if per_event:
+        return [mean_rates, rates]
+    return mean_rates
+
+'''
+This function takes output of the find_slowwave function, the spike trains of all units (list of dense spike trains or SpikeTrains), their sampling frequency, a time window [before, after]
+and a bin size in seconds, and returns the peri-event time histograms of all units around every slow wave as [counts, bins] (see peri_event_histogram in analysis_utils):
+counts is a (units x slow waves x bins) array and bins are the bin edges in seconds. The slow waves are aligned to the column align of the dataFrame ("Start", "NegPeak", "End", ...).
+'''
+
+def peth_sw(sw, spike_train, sf, window = [-1, 1], bin_size = 0.01, align = "Start", backend = 'serial', n_jobs = None):
+    align_index = get_event_align_indexes(sw, sf, align)
+    return peri_event_histogram(align_index, spike_train, sf, window, bin_size, backend, n_jobs)
+
+'''
+This function returns the spike times of all units relative to every slow wave (aligned to the column align) in the time window [before, after] as [offsets, times] (see peri_event_raster in analysis_utils).
+'''
 
-    return np.asarray(swhist)
+def raster_sw(sw, spike_train, sf, window = [-1, 1], align = "Start"):
+    align_index = get_event_align_indexes(sw, sf, align)
+    return peri_event_raster(align_index, spike_train, sf, window)
 
 '''
-This function takes the spike train of all units, its sampling frequency, slow wave dataFrame, and phase intervals as the input
-in order to output the following:
+This function takes the spike train of all units (list of dense spike trains or SpikeTrains), its sampling frequency, slow wave dataFrame, and phase intervals as the input
+in order to output an EventPhaseHist (see analysis_utils), which holds the phase histograms of all units in all slow waves as a (units x slow waves x bins) array (counts).
+Indexing it or unpacking it gives the following, which are built only when asked for:
 [num_spikes, phase_hist_spike_trains, time_spike_trains, unit_hist_arrays]
 
 1. num_spikes is an array showing how many spikes in total are found in slow waves, for each unit. You can access the data by indexing the array with unit_index
 2. phase_hist_spike_trains is a dictionary which holds the phase histograms of each slow wave, for each unit. To access the data, first you should index the
 unit_index in dictionary, (e.g. arr[str(unit_index)]) then the slow wave number.
-3. time_spike_trains is a dictionary which holds time aligned spike trains in slow wave, for each unit. Data can be accessed as demonstrated in
+3. time_spike_trains is a dictionary which holds time aligned spike trains (SpikeTrains) in slow wave, for each unit. Data can be accessed as demonstrated in
 phase_hist_spike_trains explanation
 4. unit_hist_arrays is a dictionary holding sums of the phase histogram arrays for all slow waves, for each unit.
 You can access the data by indexing the array with unit_index
+Units are analyzed on several cores with backend 'thread' or 'process' and n_jobs workers (see map_units in parallel_utils).
 '''
 
-def sw_all_units(sw, phase, sf, spike_train):
-    num_spikes = []
-    phase_hist_spike_trains = {}
-    time_spike_trains = {}
-    unit_hist_arrays = {}
-
-    for i in range(len(spike_train)):
-        hist = slowwave_phase_hist(sw, phase, sf, spike_train[i])
-        phase_hist_spike_trains[str(i)] = hist[2]
-        time_spike_trains[str(i)] = hist[3]
-        arr = hist[0:2]
-        unit_hist_arrays[str(i)] = arr
-        s = np.sum(arr[0])
-        num_spikes.append(s)
-
-    num_spikes = np.asarray(num_spikes)
-    return [num_spikes, phase_hist_spike_trains, time_spike_trains, unit_hist_arrays]
+def sw_all_units(sw, phase, sf, spike_train, backend = 'serial', n_jobs = None):
+    start_index, end_index = get_event_indexes(sw, sf)
+    return events_all_units(start_index, end_index, sw.loc[:,"Frequency"], phase, sf, spike_train, backend = backend, n_jobs = n_jobs)
+
+'''
+This function is the Hilbert phase version of sw_all_units. Instead of assuming that each slow wave is a sine wave with its "Frequency" starting at phase 0,
+the phase of each spike is read from the instantaneous phase of data (the LFP the slow waves were found in, with sampling frequency fs) band-pass filtered in freq_sw.
+Phases are computed once per channel and kept in cache (a PhaseCache), so passing the same cache to the next calls doesn't filter the data again.
+The output is an EventPhaseHist, in the format of sw_all_units.
+'''
+
+def sw_hilbert_all_units(sw, phase, sf, spike_train, data, fs, freq_sw = [0.3, 1.5], cache = None, channel = 0):
+    cache = PhaseCache(fs) if cache is None else cache
+    phase_signal = cache.get(channel, data, freq_sw)[0]
+    start_index, end_index = get_event_indexes(sw, sf)
+    return events_signal_all_units(start_index, end_index, phase_signal, phase, fs, sf, spike_train)
+
+'''
+This function takes output of the find_slowwave function, sampling frequency of the spikes and the spike trains of all units and tests if every unit is locked to the phase of the slow waves,
+assuming that each slow wave is a sine wave with its "Frequency" starting at phase 0 (as in sw_all_units). The output is the dictionary of phase_locking: mean resultant length, preferred phase,
+Rayleigh and PPC values of every unit, with p values from num_permutations circularly shifted spike trains. Pass phase_signal (e.g. from PhaseCache) and fs to use the Hilbert phase instead.
+'''
+
+def sw_phase_locking(sw, sf, spike_train, num_permutations = 1000, phase_signal = None, fs = None, seed = None):
+    start_index, end_index = get_event_indexes(sw, sf)
+    if phase_signal is not None:
+        return phase_locking(start_index, end_index, spike_train, fs, phase_signal = phase_signal, sf = sf, num_permutations = num_permutations, seed = seed)
+    return phase_locking(start_index, end_index, spike_train, sf, freq = sw.loc[:,"Frequency"].values, num_permutations = num_permutations, seed = seed)
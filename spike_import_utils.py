@@ -0,0 +1,158 @@
+"""
+Created on Sunday, 18th of October 2026
+
+Contains the functions for importing the spike times of sorted units from MATLAB cell arrays (S_CellFormat), Kilosort/Phy output directories (spike_times.npy, spike_clusters.npy)
+and plain index files (.npy, .txt, Neuroscope .res/.clu) into a SpikeTrains. All the spikes of a file are converted and clipped to the data with single array operations,
+instead of a Python loop over the spikes of every unit.
+"""
+
+import os
+import ast
+import numpy as np
+import pandas as pd
+import scipy.io as spio
+from analysis_utils import *
+
+'''
+This function takes spike times (in seconds), the sampling frequency of the spike trains and the time of their first data point (in seconds), and returns the indexes of the spikes,
+as int(time * sf) in the pipelines.
+'''
+
+def times_to_indexes(times, sf, start_time = 0):
+    return np.floor((np.asarray(times, dtype = np.float64) - start_time) * sf).astype(np.int64)
+
+'''
+This function takes the spike times (in seconds) of every unit as a list of arrays and returns [times, labels, num_units]: the spike times of all units in a single array, the position
+of the unit of every spike and the number of units.
+'''
+
+def get_labeled_times(units):
+    units = [np.asarray(unit, dtype = np.float64).ravel() for unit in units]
+    times = np.concatenate(units) if len(units) > 0 else np.zeros(0)
+    labels = np.repeat(np.arange(len(units)), [len(unit) for unit in units])
+    return [times, labels, len(units)]
+
+'''
+These functions load the spike times (in seconds) of every unit from a .mat file with a cell array of spike times per unit in spike_variable (S_CellFormat in the pipelines),
+and from a .npz file with an array of spike times per unit (in the order of their names), and return them as get_labeled_times.
+'''
+
+def load_mat_spikes(path, spike_variable = "S_CellFormat"):
+    return get_labeled_times(spio.loadmat(path)[spike_variable].ravel())
+
+def load_npz_spikes(path):
+    with np.load(path) as data:
+        return get_labeled_times([data[name] for name in data.files])
+
+'''
+This function reads the parameters of a Phy output directory (params.py, which holds lines like sample_rate = 30000.) and returns them as a dictionary.
+'''
+
+def load_phy_params(directory):
+    params = {}
+    path = os.path.join(directory, "params.py")
+    if not os.path.exists(path):
+        return params
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.partition('=')
+            try:
+                params[key.strip()] = ast.literal_eval(value.strip())
+            except (ValueError, SyntaxError):
+                continue
+    return params
+
+'''
+This function loads the spikes of a Kilosort/Phy output directory and returns [indexes, cluster_ids, sample_rate]: the indexes of all spikes (spike_times.npy), the cluster of every spike
+(spike_clusters.npy, or spike_templates.npy if the clusters weren't curated) and the sampling rate of the indexes (sample_rate of params.py, None if there is no params.py).
+'''
+
+def load_phy_spikes(directory):
+    indexes = np.load(os.path.join(directory, "spike_times.npy")).astype(np.int64).ravel()
+    clusters_path = os.path.join(directory, "spike_clusters.npy")
+    if not os.path.exists(clusters_path):
+        clusters_path = os.path.join(directory, "spike_templates.npy")
+    cluster_ids = np.load(clusters_path).astype(np.int64).ravel()
+    if len(cluster_ids) != len(indexes):
+        raise ValueError("{0} and spike_times.npy should have the same number of spikes".format(os.path.basename(clusters_path)))
+    return [indexes, cluster_ids, load_phy_params(directory).get("sample_rate")]
+
+'''
+This function returns the ids of the clusters of a Phy output directory labeled with one of groups (e.g. ["good"]) in cluster_group.tsv (or cluster_info.tsv), None if neither file exists.
+'''
+
+def load_phy_groups(directory, groups = ["good"]):
+    for name in ["cluster_group.tsv", "cluster_info.tsv"]:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            table = pd.read_csv(path, sep = '\t')
+            column = "group" if "group" in table.columns else "KSLabel"
+            return np.sort(np.asarray(table.loc[table[column].isin(groups), "cluster_id"], dtype = np.int64))
+    return None
+
+'''
+This function loads a plain index file and returns [indexes, cluster_ids]: .npy and text files hold either one spike index per row (cluster_ids are all 0) or rows of [index, cluster_id],
+and a Neuroscope .res file holds one spike index per line with the cluster of every spike in the .clu file of the same name (whose first line is the number of clusters).
+'''
+
+def load_index_file(path):
+    if path.endswith('.res'):
+        indexes = np.loadtxt(path, dtype = np.int64, ndmin = 1)
+        clu_path = path[:-len('.res')] + '.clu'
+        cluster_ids = np.loadtxt(clu_path, dtype = np.int64, ndmin = 1)[1:] if os.path.exists(clu_path) else np.zeros(len(indexes), dtype = np.int64)
+        return [indexes, cluster_ids]
+    table = np.load(path) if path.endswith('.npy') else np.loadtxt(path, delimiter = ',' if path.endswith('.csv') else None, ndmin = 1)
+    table = np.asarray(table)
+    if table.ndim == 2 and table.shape[1] >= 2:
+        return [table[:, 0].astype(np.int64), table[:, 1].astype(np.int64)]
+    indexes = table.astype(np.int64).ravel()
+    return [indexes, np.zeros(len(indexes), dtype = np.int64)]
+
+'''
+This function takes the cluster id of every spike and the ids of the units to keep (all clusters, sorted, if None), and returns [labels, unit_ids]: the position of
+the unit of every spike in unit_ids (-1 for the spikes of other clusters) and the unit ids.
+'''
+
+def get_unit_labels(cluster_ids, unit_ids = None):
+    cluster_ids = np.asarray(cluster_ids, dtype = np.int64)
+    unit_ids = np.unique(cluster_ids) if unit_ids is None else np.asarray(unit_ids, dtype = np.int64)
+    if len(unit_ids) == 0:
+        return [np.full(len(cluster_ids), -1, dtype = np.int64), unit_ids]
+    order = np.argsort(unit_ids, kind = 'stable')
+    position = np.clip(np.searchsorted(unit_ids[order], cluster_ids), 0, len(unit_ids) - 1)
+    labels = np.where(unit_ids[order][position] == cluster_ids, order[position], -1)
+    return [labels, unit_ids]
+
+'''
+This function imports the spike trains of a session from path and returns them as a SpikeTrains with sampling frequency sf and length data points, with indexes relative to start_time
+(in seconds); spikes outside the data are dropped. path can be:
+- a .mat file with a cell array of spike times (in seconds) per unit in spike_variable (S_CellFormat in the pipelines), units are the positions of the cells,
+- a Kilosort/Phy output directory, units are the cluster ids (only the clusters labeled with one of groups in cluster_group.tsv if groups is given, e.g. ["good"]),
+- a .npz file with an array of spike times (in seconds) per unit, units are the positions of the arrays,
+- a plain index file (see load_index_file), units are the cluster ids.
+Indexes of Phy directories and index files are at sample_rate (the sample_rate of params.py for Phy directories, sf if None) and converted to sf with convert_indexes.
+units selects the units to import (positions for .mat and .npz files, cluster ids otherwise) and their order. If return_ids is True, [spike_train, unit_ids] is returned.
+'''
+
+def import_spike_trains(path, sf, length, start_time = 0, units = None, spike_variable = "S_CellFormat", sample_rate = None, groups = None, return_ids = False):
+    if os.path.isdir(path):
+        indexes, cluster_ids, phy_rate = load_phy_spikes(path)
+        sample_rate = phy_rate if sample_rate is None else sample_rate
+        if units is None and groups is not None:
+            units = load_phy_groups(path, groups)
+    elif path.endswith('.mat') or path.endswith('.npz'):
+        times, cluster_ids, num_units = load_mat_spikes(path, spike_variable) if path.endswith('.mat') else load_npz_spikes(path)
+        indexes = times_to_indexes(times, sf, start_time)
+        if units is None:
+            units = np.arange(num_units)
+        start_time, sample_rate = 0, sf
+    else:
+        indexes, cluster_ids = load_index_file(path)
+
+    sample_rate = sf if sample_rate is None else sample_rate
+    indexes = convert_indexes(indexes, sample_rate, sf) - int(round(start_time * sf))
+    labels, unit_ids = get_unit_labels(cluster_ids, units)
+    spike_train = get_labeled_spike_trains(indexes, labels, len(unit_ids), length)
+    if return_ids:
+        return [spike_train, unit_ids]
+    return spike_train
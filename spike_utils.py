@@ -0,0 +1,113 @@
+"""
+Created on Sunday, 18th of October 2026
+
+Contains the functions for detecting spikes in long raw recordings, streaming over memory-mapped data in chunks and returning spike indexes instead of dense spike trains.
+"""
+
+import numpy as np
+from scipy import signal
+from analysis_utils import *
+from parallel_utils import *
+
+'''
+This function takes a (high-pass filtered) signal and returns a robust estimate of its noise level (standard deviation): the median absolute deviation from the median divided by 0.6745.
+Unlike the variance, it is barely affected by the spikes themselves and it is computed with numpy instead of a Python loop over the samples.
+'''
+
+def get_noise_level(data):
+    data = np.asarray(data, dtype = np.float64)
+    return np.median(np.abs(data - np.median(data))) / 0.6745
+
+'''
+This function takes the indexes and heights of peaks sorted by index and the refractory period in data points, and removes peaks until no two peaks are closer than the refractory period,
+with the rule of the distance argument of scipy.signal.find_peaks: going from the highest peak to the lowest one, every peak which wasn't removed yet is kept and the peaks closer to it
+than the refractory period are removed (of two peaks of the same height, the earlier one is kept). Only the peaks which have a neighbour closer than the refractory period are visited.
+'''
+
+def enforce_refractory(indexes, heights, refractory):
+    indexes = np.asarray(indexes, dtype = np.int64)
+    heights = np.asarray(heights, dtype = np.float64)
+    close = np.flatnonzero(np.diff(indexes) < refractory)
+    keep = np.ones(len(indexes), dtype = bool)
+    candidates = np.union1d(close, close + 1)
+    for peak in candidates[np.lexsort((candidates, -heights[candidates]))]:
+        if not keep[peak]:
+            continue
+        neighbour = peak - 1
+        while neighbour >= 0 and indexes[peak] - indexes[neighbour] < refractory:
+            keep[neighbour] = False
+            neighbour -= 1
+        neighbour = peak + 1
+        while neighbour < len(indexes) and indexes[neighbour] - indexes[peak] < refractory:
+            keep[neighbour] = False
+            neighbour += 1
+    return [indexes[keep], heights[keep]]
+
+'''
+This function detects the spikes in one chunk of data (an element of the output of get_chunks, which is in seconds) and returns [indexes, heights] of the spikes owned by the chunk, with indexes
+in the whole data. The noise level is estimated in the chunk itself, so the threshold (coeff times the noise level) follows slow changes of the noise along the recording.
+'''
+
+def detect_spike_chunk(data, fs, chunk, coeff = 5, refractory = 1e-3, freq_range = None, spike = True):
+    start, end, owned_start, owned_end = chunk
+    chunk_data = np.asarray(data[start:end], dtype = np.float64)
+    if freq_range is not None:
+        chunk_data = bandpass_filter(chunk_data, fs, freq_range)
+    if spike:
+        # only negative peaks are detected in the recording because positive peaks follow them
+        chunk_data = -chunk_data
+    height = get_noise_level(chunk_data) * coeff
+    distance = max(int(refractory * fs), 1)
+    indexes, properties = signal.find_peaks(chunk_data, height = height, distance = distance)
+    indexes = indexes + start
+    owned = (indexes >= owned_start * fs) & (indexes < owned_end * fs)
+    return [indexes[owned], properties["peak_heights"][owned]]
+
+'''
+This function takes a raw (or high-pass filtered) signal, which can be any 1-D array-like that supports slicing such as a channel of a memory-mapped Recording (see recording_utils),
+and its sampling frequency, and returns the indexes of its spikes. Only chunk_duration seconds of the signal are in memory at a time. In every chunk the signal is band-pass filtered
+in freq_range (not filtered if None), its noise level is estimated with get_noise_level and the peaks higher than coeff times the noise level are found; spikes closer than refractory
+seconds are merged, keeping the highest one. Negative peaks are detected if spike is True, positive peaks otherwise (as in find_peaks). If return_heights is True, [indexes, heights] is returned.
+'''
+
+def detect_spikes(data, fs, coeff = 5, refractory = 1e-3, freq_range = [300, 6000], spike = True, chunk_duration = 10, overlap_duration = 0.1, return_heights = False):
+    length = len(data)
+    chunks = get_chunks(length, fs, chunk_duration, overlap_duration) if length > 0 else []
+    results = [detect_spike_chunk(data, fs, chunk, coeff, refractory, freq_range, spike) for chunk in chunks]
+    indexes = np.concatenate([result[0] for result in results]) if results else np.zeros(0, dtype = np.int64)
+    heights = np.concatenate([result[1] for result in results]) if results else np.zeros(0)
+    # spikes near the border of two chunks are detected by different chunks, so the refractory period is enforced again
+    indexes, heights = enforce_refractory(indexes, heights, max(int(refractory * fs), 1))
+    if return_heights:
+        return [indexes, heights]
+    return indexes
+
+'''
+This function is run by the workers of detect_spikes_multichannel. It detects the spikes of a single channel of the data source.
+'''
+
+def detect_channel_spikes(source, channel, fs, kwargs):
+    return detect_spikes(get_channel(source, channel), fs, **kwargs)
+
+'''
+This function detects the spikes of several channels of a recording (a Recording or an array of shape channels x samples) in parallel, one task per channel, and returns them
+as a SpikeTrains with one unit (the multi-unit activity) per channel. The other arguments are passed to detect_spikes.
+'''
+
+def detect_spikes_multichannel(data, fs, channels = None, backend = 'process', n_jobs = None, **kwargs):
+    if hasattr(data, 'channel'):
+        num_channels, length = data.num_channels, len(data)
+    else:
+        num_channels, length = np.shape(data)
+    channels = range(num_channels) if channels is None else channels
+
+    source = data
+    if backend == 'process' and not hasattr(data, 'channel'):
+        source = SharedArray(data)
+    try:
+        tasks = [[source, channel, fs, kwargs] for channel in channels]
+        indexes = map_tasks(detect_channel_spikes, tasks, backend, n_jobs)
+    finally:
+        if isinstance(source, SharedArray):
+            source.close()
+    return get_spike_trains(indexes, length)
@@ -9,7 +9,10 @@ Contains the functions for analyzing electrophysiological data, specifically fin
 import numpy as np
 from matplotlib import pyplot as plt
 from analysis_utils import *
+from parallel_utils import *
+from stats_utils import *
 import yasa
+from functools import partial
 
 '''
 This function takes output of the find_spindles function (pandas dataFrame that has spindle data), phase intervals of the histogram, sampling frequency, and spike train in order to
@@ -23,12 +26,14 @@ def spindle_phase_hist(sp, phase, fs, spike_train):
     heights = []
     flag = True
     index = 0
+    start_indexes, end_indexes = get_event_indexes(sp, fs)
 
     for freq in sp.loc[:,"Frequency"]:
-        start_index = int(sp.loc[index,"Start"] * fs)
-        end_index = int(sp.loc[index,"End"] * fs)
-        time_spike_trains[str(index)] = spike_train[start_index:end_index]
-        phase_histogram = phase_hist(spike_train[start_index:end_index], freq, phase, fs)
+        start_index = start_indexes[index]
+        end_index = end_indexes[index]
+        window = slice_spike_train(spike_train, start_index, end_index)
+        time_spike_trains[str(index)] = window
+        phase_histogram = phase_hist(window, freq, phase, fs)
         phase_hist_spike_trains[str(index)] = phase_histogram
         if flag:
             bins = phase_histogram[1]
@@ -52,13 +57,14 @@ def spindle_envelope_phase_hist(sp, phase, fs, spike_train):
     heights = []
     flag = True
     index = 0
+    start_indexes, end_indexes = get_event_indexes(sp, fs)
+    durations = np.asarray(sp.loc[:,"Duration"], dtype = np.float64)
 
     for freq in sp.loc[:,"Frequency"]:
-        start_index = int(sp.loc[index,"Start"] * fs)
-        end_index = int(sp.loc[index,"End"] * fs)
-        duration = float(sp.loc[index,"Duration"])
-        freq = 1/duration
-        phase_histogram = phase_hist(spike_train[start_index:end_index], freq, phase, fs)
+        start_index = start_indexes[index]
+        end_index = end_indexes[index]
+        freq = 1 / durations[index]
+        phase_histogram = phase_hist(slice_spike_train(spike_train, start_index, end_index), freq, phase, fs)
         phase_hist_spike_trains[str(index)] = phase_histogram
         if flag:
             bins = phase_histogram[1]
@@ -76,18 +82,33 @@ This function takes a data and its sampling frequency in order to produce a pand
 '''
 
 def find_spindles(data, fs, thresh={'rel_pow': 0.2, 'corr': 0.65, 'rms': 1.5}):
-    return yasa.spindles_detect(data, fs, thresh = thresh)
+    return get_event_table(yasa.spindles_detect(data, fs, thresh = thresh))
+
+'''
+This function takes a long data (e.g. a channel of a memory-mapped Recording) and its sampling frequency and finds the spindles in overlapping chunks of chunk_duration seconds
+using detect_chunked, so that the whole recording never has to be in memory. It returns a single pandas Dataframe with the times of the spindles in the whole recording.
+'''
+
+def find_spindles_chunked(data, fs, thresh={'rel_pow': 0.2, 'corr': 0.65, 'rms': 1.5}, chunk_duration = 600, overlap_duration = 10):
+    return detect_chunked(partial(find_spindles, thresh = thresh), data, fs, chunk_duration, overlap_duration)
+
+'''
+This function takes a multichannel data (a memory-mapped Recording or an array of shape (channels x samples)) and its sampling frequency and finds the spindles of the given channels
+(all channels if None) in parallel with detect_multichannel, using a pool of n_jobs workers (number of cores if None). Channels are also split into chunks if chunk_duration is given.
+It returns a single pandas Dataframe of the spindles of all channels, with the channel index of each one in the "Channel" column.
+'''
+
+def find_spindles_multichannel(data, fs, channels = None, thresh={'rel_pow': 0.2, 'corr': 0.65, 'rms': 1.5}, chunk_duration = None, overlap_duration = 10, backend = 'process', n_jobs = None):
+    return detect_multichannel(partial(find_spindles, thresh = thresh), data, fs, channels, chunk_duration, overlap_duration, backend, n_jobs)
 
 '''
 This function is for plotting the spindles on the top of raw data in a specific time limit, taking data, time, sampling frequency, xlabel, ylabel, title, and time limit as input.
 '''
 
 def plot_spindles(data, times, fs, sp, xlabel, ylabel, title, time_limit):
-    bool_spindles = yasa.get_bool_vector(data, fs, sp)
-    spindles_highlight = data * bool_spindles
-
-    plt.plot(times, data, 'k')
-    plt.plot(times, spindles_highlight, 'indianred')
+    pyramid = get_pyramid(data, fs, times[0])
+    plot_trace(pyramid, time_limit, color = 'k')
+    plot_trace(pyramid, time_limit, get_event_index(sp, fs).ranges, color = 'indianred')
     plt.xlabel(xlabel)
     plt.ylabel(ylabel)
     plt.xlim(time_limit)
@@ -101,86 +122,85 @@ It will save the raw data for each spindle, in the following format: {'0': [spin
 
 def save_spindles(data0, fs, sp):
     spindle_dict = {}
-    index = 0
-    for start in sp.loc[:,"Start"]:
-        start_index = int(start * fs)
-        end_index = int(sp.loc[index,"End"] * fs)
-        spindle_dict[str(index)] = data0[start_index:end_index]
-        index += 1
+    start_index, end_index = get_event_indexes(sp, fs)
+    for index in range(len(start_index)):
+        spindle_dict[str(index)] = data0[start_index[index]:end_index[index]]
     return spindle_dict
 
 '''
-This function takes the spindle dataframe, spike_train of every unit, sampling frequency, a time interval in seconds (dt)
+This function takes the spindle dataframe, spike_train of every unit (list of dense spike trains or SpikeTrains), sampling frequency, a time interval in seconds (dt)
 as input to output the following information about for each unit:
 [Average firing rate of the unit in the following time interval [start - dt:start],
 Average firing rate of the unit in the following time interval [spindle duration],
 Average firing rate of the unit in the following time interval [end : end + dt]]
 You can access this information by indexing the output array[unit_index]
+Windows are clipped at the edges of the recording and windows completely outside of the recording are left out of the averages.
+If per_event is True, [averages, rates] is returned where rates is a (units x events x 3) array holding the same firing rates for every spindle.
+Units are analyzed on several cores with backend 'thread' or 'process' and n_jobs workers (see map_units in parallel_utils).
 '''
 
-def firing_rate_spindle(sp, spike_train, sf, dt):
-    sphist = []
-    index = 0
-    for i in range(len(spike_train)):
-        ind = 0
-        frs = 0
-        frb = 0
-        fra = 0
-        for freq in sp.loc[:,"Frequency"]:
-            start_index = int(sp.loc[ind,"Start"] * sf)
-            end_index = int(sp.loc[ind,"End"] * sf)
-            duration = sp.loc[ind,"Duration"]
-            for j in spike_train[i][start_index:end_index]:
-                if j == 1:
-                    frs += (1/duration)
-            for j in spike_train[i][int(start_index - dt * sf):start_index]:
-                if j == 1:
-                    frb += (1/dt)
-            for j in spike_train[i][end_index:int(end_index + dt * sf)]:
-                if j == 1:
-                    fra += (1/dt)
-            ind += 1
-
-        sphist.append([frb/ ind, frs/ ind, fra/ ind])
-        index += 1
+def firing_rate_spindle(sp, spike_train, sf, dt, per_event = False, backend = 'serial', n_jobs = None):
+    start_index, end_index = get_event_indexes(sp, sf)
+    rates = peri_event_rates(start_index, end_index, sp.loc[:,"Duration"], spike_train, sf, dt, backend, n_jobs)
+    mean_rates = np.nanmean(rates, axis = 1)
+    if per_event:
+        return [mean_rates, rates]
+    return mean_rates
 
-    return np.asarray(sphist)
+'''
+This function takes output of the find_spindles function, the spike trains of all units (list of dense spike trains or SpikeTrains), their sampling frequency, a time window [before, after]
+and a bin size in seconds, and returns the peri-event time histograms of all units around every spindle as [counts, bins] (see peri_event_histogram in analysis_utils):
+counts is a (units x spindles x bins) array and bins are the bin edges in seconds. The spindles are aligned to the column align of the dataFrame ("Start", "Peak", "End", ...).
+'''
+
+def peth_spindle(sp, spike_train, sf, window = [-1, 1], bin_size = 0.01, align = "Start", backend = 'serial', n_jobs = None):
+    align_index = get_event_align_indexes(sp, sf, align)
+    return peri_event_histogram(align_index, spike_train, sf, window, bin_size, backend, n_jobs)
 
 '''
-This function takes the spike train of all units, its samplng frequency, spindle dataFrame, and phase intervals as the input
-in order to output the following:
+This function returns the spike times of all units relative to every spindle (aligned to the column align) in the time window [before, after] as [offsets, times] (see peri_event_raster in analysis_utils).
+'''
+
+def raster_spindle(sp, spike_train, sf, window = [-1, 1], align = "Start"):
+    align_index = get_event_align_indexes(sp, sf, align)
+    return peri_event_raster(align_index, spike_train, sf, window)
+
+'''
+This function takes the spike train of all units (list of dense spike trains or SpikeTrains), its samplng frequency, spindle dataFrame, and phase intervals as the input
+in order to output an EventPhaseHist (see analysis_utils), which holds the phase histograms of all units in all spindles as a (units x spindles x bins) array (counts).
+Indexing it or unpacking it gives the following, which are built only when asked for:
 [num_spikes, phase_hist_spike_trains, time_spike_trains, unit_hist_arrays]
 
 1. num_spikes is an array showing how many spikes in total are found in spindles, for each unit. You can access the data by indexing the array with unit_index
 2. phase_hist_spike_trains is a dictionary which holds the phase histograms of each spindle, for each unit. To access the data, first you should index the
 unit_index in dictionary, (e.g. arr[str(unit_index)]) then the spindle number.
-3. time_spike_trains is a dictionary which holds time aligned spike trains in spindles, for each unit. Data can be accessed as demonstrated in
+3. time_spike_trains is a dictionary which holds time aligned spike trains (SpikeTrains) in spindles, for each unit. Data can be accessed as demonstrated in
 phase_hist_spike_trains explanation
 4. unit_hist_arrays is a dictionary holding sums of the phase histogram arrays for all spindles, for each unit.
 You can access the data by indexing the array with unit_index
+Units are analyzed on several cores with backend 'thread' or 'process' and n_jobs workers (see map_units in parallel_utils).
 '''
 
-def spindle_all_units(sp, phase, sf, spike_train):
-    num_spikes = []
-    phase_hist_spike_trains = {}
-    time_spike_trains = {}
-    unit_hist_arrays = {}
+def spindle_all_units(sp, phase, sf, spike_train, backend = 'serial', n_jobs = None):
+    start_index, end_index = get_event_indexes(sp, sf)
+    return events_all_units(start_index, end_index, sp.loc[:,"Frequency"], phase, sf, spike_train, backend = backend, n_jobs = n_jobs)
 
-    for i in range(len(spike_train)):
-        hist = spindle_phase_hist(sp, phase, sf, spike_train[i])
-        phase_hist_spike_trains[str(i)] = hist[2]
-        time_spike_trains[str(i)] = hist[3]
-        arr = hist[0:2]
-        unit_hist_arrays[str(i)] = arr
-        s = np.sum(arr[0])
-        num_spikes.append(s)
+'''
+This function is the Hilbert phase version of spindle_all_units and spindle_envelope_all_units. Instead of assuming that each spindle is a sine wave with its "Frequency" (or 1/Duration for the envelope)
+starting at phase 0, the phase of each spike is read from the instantaneous phase of data (the LFP the spindles were found in, with sampling frequency fs) band-pass filtered in freq_sp,
+or from the instantaneous phase of its envelope if envelope is True. Phases are computed once per channel and kept in cache (a PhaseCache), so passing the same cache to the next calls
+(e.g. for the envelope or another phase interval) doesn't filter the data again. The output is an EventPhaseHist, in the format of spindle_all_units (spindle_envelope_all_units if envelope is True).
+'''
 
-    num_spikes = np.asarray(num_spikes)
-    return [num_spikes, phase_hist_spike_trains, time_spike_trains, unit_hist_arrays]
+def spindle_hilbert_all_units(sp, phase, sf, spike_train, data, fs, freq_sp = [12, 15], envelope = False, cache = None, channel = 0):
+    cache = PhaseCache(fs) if cache is None else cache
+    phase_signal = cache.get(channel, data, freq_sp)[1 if envelope else 0]
+    start_index, end_index = get_event_indexes(sp, sf)
+    return events_signal_all_units(start_index, end_index, phase_signal, phase, fs, sf, spike_train, ENVELOPE_OUTPUTS if envelope else ALL_UNITS_OUTPUTS)
 
 '''
-This function takes the spike train of all units, its samplng frequency, spindle dataFrame, and phase intervals as the input
-in order to output the following:
+This function takes the spike train of all units (list of dense spike trains or SpikeTrains), its samplng frequency, spindle dataFrame, and phase intervals as the input
+in order to output an EventPhaseHist of the spindle envelope phase histograms, which gives the following when indexed or unpacked:
 [phase_hist_envelope_spike_trains, unit_hist_envelope_arrays]
 
 
@@ -188,16 +208,21 @@ in order to output the following:
 To access the data, first you should index the unit_index in dictionary, (e.g. arr[str(unit_index)]) then the spindle number.
 2. unit_hist_arrays is a dictionary holding sums of the phase histogram arrays for all spindles, for each unit.
 You can access the data by indexing the array with unit_index
+Every spindle is stretched to one cycle of its envelope with time_warped_hist (see analysis_utils), using the exact start and end times of the spindle instead of truncated indexes.
+Units are analyzed on several cores with backend 'thread' or 'process' and n_jobs workers (see map_units in parallel_utils).
 '''
 
-def spindle_envelope_all_units(sp, phase, sf, spike_train):
-    phase_hist_spike_trains = {}
-    unit_hist_arrays = {}
+def spindle_envelope_all_units(sp, phase, sf, spike_train, backend = 'serial', n_jobs = None):
+    return events_warped_all_units(sp.loc[:,"Start"], sp.loc[:,"End"], phase, sf, spike_train, ENVELOPE_OUTPUTS, backend, n_jobs)
 
-    for i in range(len(spike_train)):
-        hist = spindle_envelope_phase_hist(sp, phase, sf, spike_train[i])
-        phase_hist_spike_trains[str(i)] = hist[2]
-        arr = hist[0:2]
-        unit_hist_arrays[str(i)] = arr
+'''
+This function takes output of the find_spindles function, sampling frequency of the spikes and the spike trains of all units and tests if every unit is locked to the phase of the spindles,
+assuming that each spindle is a sine wave with its "Frequency" starting at phase 0 (as in spindle_all_units). The output is the dictionary of phase_locking: mean resultant length, preferred phase,
+Rayleigh and PPC values of every unit, with p values from num_permutations circularly shifted spike trains. Pass phase_signal (e.g. from PhaseCache) and fs to use the Hilbert phase instead.
+'''
 
-    return [phase_hist_spike_trains, unit_hist_arrays]
+def spindle_phase_locking(sp, sf, spike_train, num_permutations = 1000, phase_signal = None, fs = None, seed = None):
+    start_index, end_index = get_event_indexes(sp, sf)
+    if phase_signal is not None:
+        return phase_locking(start_index, end_index, spike_train, fs, phase_signal = phase_signal, sf = sf, num_permutations = num_permutations, seed = seed)
+    return phase_locking(start_index, end_index, spike_train, sf, freq = sp.loc[:,"Frequency"].values, num_permutations = num_permutations, seed = seed)
@@ -0,0 +1,132 @@
+"""
+Created on Sunday, 18th of October 2026
+
+Contains the functions for testing if spike trains are locked to the phase of spindles and slow waves, using circular statistics and shuffled (circularly shifted) spike trains.
+"""
+
+import numpy as np
+from analysis_utils import *
+
+'''
+This function takes phases (in radians), the group of each phase (e.g. the unit of each spike) and the number of groups and returns the circular statistics of every group as a dictionary of arrays:
+n (number of phases), mean_resultant_length, preferred_phase (mean direction in [0, 2 pi)), rayleigh_z, rayleigh_p (p value of the Rayleigh test of uniformity) and
+ppc (pairwise phase consistency, which doesn't depend on the number of spikes as the mean resultant length does). Groups without phases have nan values.
+'''
+
+def circular_stats(phases, group, num_groups):
+    n = np.bincount(group, minlength = num_groups).astype(np.float64)
+    sum_cos = np.bincount(group, weights = np.cos(phases), minlength = num_groups)
+    sum_sin = np.bincount(group, weights = np.sin(phases), minlength = num_groups)
+    return circular_stats_from_sums(n, sum_cos, sum_sin)
+
+'''
+This function computes the statistics of circular_stats from the number of phases and the sums of their cosines and sines, which can be of any shape.
+'''
+
+def circular_stats_from_sums(n, sum_cos, sum_sin):
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        resultant = np.hypot(sum_cos, sum_sin)
+        mean_resultant_length = np.where(n > 0, resultant / n, np.nan)
+        preferred_phase = np.where(n > 0, np.mod(np.arctan2(sum_sin, sum_cos), 2 * np.pi), np.nan)
+        rayleigh_z = np.where(n > 0, resultant ** 2 / n, np.nan)
+        # approximation of the p value of the Rayleigh test (Zar, Biostatistical Analysis)
+        rayleigh_p = np.where(n > 0, np.minimum(np.exp(np.sqrt(1 + 4 * n + 4 * (n ** 2 - resultant ** 2)) - (1 + 2 * n)), 1), np.nan)
+        ppc = np.where(n > 1, (resultant ** 2 - n) / (n * (n - 1)), np.nan)
+    return {"n": n, "mean_resultant_length": mean_resultant_length, "preferred_phase": preferred_phase, "rayleigh_z": rayleigh_z, "rayleigh_p": rayleigh_p, "ppc": ppc}
+
+'''
+This function takes start and end indexes of events, the spike trains of all units (SpikeTrains) and an array of shifts (permutations x units, in data points), and finds the spikes of every unit
+in every event after every unit is shifted circularly by its shift (a spike at index i moves to (i + shift) % length). Instead of shifting and sorting the spikes again, the events are shifted
+back and searched in the spikes of each unit written twice ([spikes, spikes + length]), so a shifted event which wraps around the end of the recording is a single range.
+It returns [pair, position]: pair is (permutation * units + unit) * events + event and position is the index of the shifted spike in the recording, for every shifted spike inside every event.
+'''
+
+def get_shifted_event_spikes(start_index, end_index, spike_train, shifts):
+    length = spike_train.length
+    num_units = len(spike_train)
+    start_index = np.clip(np.asarray(start_index, dtype = np.int64), 0, length)
+    end_index = np.clip(np.asarray(end_index, dtype = np.int64), start_index, length)
+    shifts = np.asarray(shifts, dtype = np.int64).reshape(-1, num_units)
+
+    # spikes of every unit written twice, keyed by unit * stride so that all units are sorted in a single array
+    num_spikes = spike_train.num_spikes()
+    stride = 2 * length + 1
+    unit = np.repeat(np.arange(num_units, dtype = np.int64), num_spikes)
+    rank = np.arange(len(spike_train.indices), dtype = np.int64) - spike_train.offsets[unit]
+    doubled = np.empty(2 * len(spike_train.indices), dtype = np.int64)
+    doubled[2 * spike_train.offsets[unit] + rank] = spike_train.indices
+    doubled[2 * spike_train.offsets[unit] + num_spikes[unit] + rank] = spike_train.indices + length
+    keys = np.repeat(np.arange(num_units, dtype = np.int64) * stride, 2 * num_spikes) + doubled
+
+    shifted_start = np.mod(start_index[np.newaxis, np.newaxis, :] - shifts[:, :, np.newaxis], max(length, 1))
+    shifted_end = shifted_start + (end_index - start_index)[np.newaxis, np.newaxis, :]
+    unit_offset = (np.arange(num_units, dtype = np.int64) * stride)[np.newaxis, :, np.newaxis]
+    lo = np.searchsorted(keys, unit_offset + shifted_start).ravel()
+    counts = np.searchsorted(keys, unit_offset + shifted_end).ravel() - lo
+
+    pair_start = np.cumsum(counts) - counts
+    pair = np.repeat(np.arange(len(counts), dtype = np.int64), counts)
+    spikes = doubled[np.arange(len(pair), dtype = np.int64) - pair_start[pair] + lo[pair]]
+    event = pair % max(len(start_index), 1)
+    position = spikes - shifted_start.ravel()[pair] + start_index[event]
+    return [pair, position]
+
+'''
+This function takes the positions of spikes inside events, the events they are in, and either the sine wave frequency of every event (phase 0 at the start of the event, as in phase_hist)
+or an instantaneous phase signal with sampling frequency fs (e.g. from PhaseCache, sf is then the sampling frequency of the spikes), and returns the phases of the spikes in radians.
+'''
+
+def get_event_spike_phases(position, event, start_index, fs, freq = None, phase_signal = None, sf = None):
+    if phase_signal is not None:
+        return get_spike_phases(phase_signal, position, fs, fs if sf is None else sf)
+    relative_index = position - np.asarray(start_index, dtype = np.int64)[event]
+    cycles = relative_index * (np.asarray(freq, dtype = np.float64)[event] / fs)
+    return 2 * np.pi * (cycles - np.floor(cycles))
+
+'''
+This function tests if the spikes of every unit are locked to the phase of the events (e.g. spindles), pooling the spikes of all events. Phases are computed as in get_event_spike_phases
+(sine waves with freq, or phase_signal). It returns the circular_stats of every unit, together with a shuffle-based null distribution: every unit is circularly shifted by a random amount
+(at least min_shift data points from its original position, one second of fs if None) num_permutations times, and null_mean_resultant_length and null_ppc are (permutations x units) arrays
+of the statistics of the shifted spikes. p_value is the fraction of permutations with a mean resultant length at least as high as the real one. Permutations are computed in batches of
+batch_size (chosen to keep about 2e7 spikes or unit-event windows per batch in memory if None) with a single searchsorted per batch, instead of calling phase_hist for every surrogate.
+'''
+
+def phase_locking(start_index, end_index, spike_train, fs, freq = None, phase_signal = None, sf = None, num_permutations = 1000, min_shift = None, batch_size = None, seed = None):
+    spike_train = as_spike_trains(spike_train)
+    num_units = len(spike_train)
+    num_events = len(start_index)
+    spike_fs = fs if sf is None else sf
+    rng = np.random.default_rng(seed)
+
+    def unit_sums(shifts):
+        pair, position = get_shifted_event_spikes(start_index, end_index, spike_train, shifts)
+        phases = get_event_spike_phases(position, pair % max(num_events, 1), start_index, fs, freq, phase_signal, sf)
+        group = pair // max(num_events, 1)
+        num_groups = len(shifts) * num_units
+        n = np.bincount(group, minlength = num_groups).astype(np.float64)
+        sum_cos = np.bincount(group, weights = np.cos(phases), minlength = num_groups)
+        sum_sin = np.bincount(group, weights = np.sin(phases), minlength = num_groups)
+        return [x.reshape(len(shifts), num_units) for x in [n, sum_cos, sum_sin]]
+
+    observed = unit_sums(np.zeros((1, num_units), dtype = np.int64))
+    stats = circular_stats_from_sums(*[x[0] for x in observed])
+
+    length = spike_train.length
+    min_shift = int(spike_fs) if min_shift is None else int(min_shift)
+    min_shift = min(min_shift, max(length // 2 - 1, 0))
+    if batch_size is None:
+        batch_size = max(1, int(2e7 // max(observed[0].sum(), num_units * num_events, 1)))
+
+    null = [[], []]
+    for first in range(0, num_permutations, batch_size):
+        num_batch = min(batch_size, num_permutations - first)
+        shifts = rng.integers(min_shift, max(length - min_shift, min_shift + 1), size = (num_batch, num_units))
+        batch = circular_stats_from_sums(*unit_sums(shifts))
+        null[0].append(batch["mean_resultant_length"])
+        null[1].append(batch["ppc"])
+
+    stats["null_mean_resultant_length"] = np.concatenate(null[0]) if num_permutations > 0 else np.zeros((0, num_units))
+    stats["null_ppc"] = np.concatenate(null[1]) if num_permutations > 0 else np.zeros((0, num_units))
+    exceed = np.sum(stats["null_mean_resultant_length"] >= stats["mean_resultant_length"][np.newaxis, :], axis = 0)
+    stats["p_value"] = np.where(stats["n"] > 0, (exceed + 1) / (num_permutations + 1), np.nan)
+    return stats